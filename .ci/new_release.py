@@ -11,33 +11,51 @@ $FSLINSTALLER_DEPLOY_DIRECTORY environment variable.
 
 import sys
 
-def read_attr(srcfile, attr):
-    for line in open(srcfile, 'rt'):
-        if line.startswith('{} = '.format(attr)):
-            version = line.strip().split()[2]
-            version = version.strip("'")
-            return version
-    raise RuntimeError(f'Could not find {attr} in {srcfile}')
-
-
-def insert_templated_content(srcfile, destfile):
-
-    template_id = read_attr(srcfile, 'TEMPLATE_IDENTIFIER')
-    srclines    = open(srcfile, 'rt').readlines()
-    destlines   = []
-
-    for line in srclines:
-        line = line.rstrip()
-        if line.startswith(template_id):
-            content_file = line.removeprefix(template_id).strip()
-            contents     = open(content_file, 'rt').read().replace('\\', '\\\\')
-            destlines.append(contents)
-        else:
-            destlines.append(line)
-
-    with open(destfile, 'wt') as f:
-        for line in destlines:
-            f.write(f'{line}\n')
+def read_attrs(srcfile, attrs):
+    """Read the values of the given module-level string attributes from
+    srcfile in a single pass. Returns a tuple containing the raw file
+    contents (as bytes), and a dict of {attr : value} pairs.
+    """
+    with open(srcfile, 'rb') as f:
+        text = f.read()
+
+    values = {}
+
+    for line in text.splitlines():
+        if line[:1] != b' ' and b' = ' in line:
+            name, value = line.split(b' = ', 1)
+            name        = name.decode()
+            if name in attrs and name not in values:
+                values[name] = value.decode().strip().strip("'")
+
+    for attr in attrs:
+        if attr not in values:
+            raise RuntimeError(f'Could not find {attr} in {srcfile}')
+
+    return text, values
+
+
+def insert_templated_content(srctext, template_id, destfile):
+
+    # Everything is kept as bytes, so that
+    # inserted file contents can be escaped
+    # and copied without being decoded.
+    template_id = template_id.encode()
+
+    # Cheap first-character test so that the
+    # vast majority of lines are rejected
+    # without a full prefix comparison
+    tid_first = template_id[:1]
+
+    with open(destfile, 'wb') as dest:
+        for line in srctext.splitlines(keepends=True):
+            if line[:1] == tid_first and line.startswith(template_id):
+                content_file = line.removeprefix(template_id).strip()
+                with open(content_file, 'rb') as c:
+                    dest.write(c.read().replace(b'\\', b'\\\\'))
+                dest.write(b'\n')
+            else:
+                dest.write(line)
 
 def main():
     if len(sys.argv) != 4:
@@ -47,13 +65,15 @@ def main():
     destfile = sys.argv[2].strip()
     tag      = sys.argv[3].strip()
 
-    version  = read_attr(srcfile, '__version__')
+    srctext, attrs = read_attrs(srcfile, {'TEMPLATE_IDENTIFIER',
+                                          '__version__'})
+    version        = attrs['__version__']
 
     if version != tag:
         raise RuntimeError(f'Version in {srcfile} does not match tag! '
                            f'{version} != {tag}')
 
-    insert_templated_content(srcfile, destfile)
+    insert_templated_content(srctext, attrs['TEMPLATE_IDENTIFIER'], destfile)
 
 if __name__ == '__main__':
     main()
@@ -9,6 +9,7 @@
 
 import os
 import re
+import shlex
 
 from fsl_ci        import (USERNAME,
                            EMAIL,
@@ -39,6 +40,13 @@ that end users are running the latest version of the `fslinstaller.py` script.
 """.strip()
 
 
+def batch_commands(cmds):
+    """Combine a list of shell commands into a single "bash -c" command,
+    which stops at the first command that fails.
+    """
+    return 'bash -c ' + shlex.quote(' && '.join(cmds))
+
+
 def update_manifest(version):
 
     with open('fsl-release.yml', 'rt') as f:
@@ -71,16 +79,23 @@ def checkout_and_update_manifest(server, token, tag, base_branch):
     branch        = gen_branch_name(branch, MANIFEST_PATH, server, token)
     msg           = COMMIT_MSG.format(tag)
 
+    # git commands are run in two batches (before
+    # and after the manifest file is updated), to
+    # avoid spawning a separate process for each
+    # command.
+    pre_update = [f'git config user.name  {USERNAME}',
+                  f'git config user.email {EMAIL}',
+                  f'git checkout -b {branch} origin/{base_branch}']
+    post_update = [ 'git add *',
+                   f'git commit -m "{msg}"',
+                   f'git push origin {branch}']
+
     with tempdir():
         sprun(f'git clone {manifest_url} manifest')
         with indir('manifest'):
-            sprun(f'git config user.name  {USERNAME}')
-            sprun(f'git config user.email {EMAIL}')
-            sprun(f'git checkout -b {branch} origin/{base_branch}')
+            sprun(batch_commands(pre_update))
             update_manifest(tag)
-            sprun( 'git add *')
-            sprun(f'git commit -m "{msg}"')
-            sprun(f'git push origin {branch}')
+            sprun(batch_commands(post_update))
 
     return branch
 
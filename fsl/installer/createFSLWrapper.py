@@ -71,18 +71,106 @@
 #   createFSLWrapper fsl-cluster=cluster
 
 
-import argparse
+import functools
 import os
 import os.path as op
 import sys
-import textwrap as tw
+import types
+
+
+# Python executable - run it via the
+# specified python interpreter in
+# isolated mode (strip leading '#!')
+PYTHON_WRAPPER_TEMPLATE = '#!/usr/bin/env bash\n' \
+                          '{interp} -I {target}{args} "$@"'
+
+# Non-python executable - use
+# a pass-through script
+OTHER_WRAPPER_TEMPLATE = '#!/usr/bin/env bash\n' \
+                         '{target}{args} "$@"'
+
+# Suffix used for FSL GUI commands
+# (see the wrapper_jobs function)
+GUI_SUFFIX     = '_gui'
+GUI_SUFFIX_LEN = len(GUI_SUFFIX)
+
+
+# Command-line flags/options accepted by this
+# script, used by parse_args_fast. Keys are
+# flags, values are attribute names.
+FLAGS   = {'-f' : 'force',      '--force'      : 'force',
+           '-r' : 'no_resolve', '--no-resolve' : 'no_resolve'}
+OPTIONS = {'-a' : 'args',       '--args'       : 'args',
+           '-s' : 'srcdir',     '--srcdir'     : 'srcdir',
+           '-d' : 'destdir',    '--destdir'    : 'destdir',
+           '-p' : 'platform',   '--platform'   : 'platform'}
 
 
 def parse_args(argv=None):
+    '''Parse command-line arguments. This script is called by the post-link
+    script of every FSL package, so typical usage is parsed by hand to avoid
+    the cost of importing and configuring argparse. argparse is used for
+    anything else (e.g. --help or invalid arguments).
+    '''
 
     if argv is None:
         argv = sys.argv[1:]
 
+    args = parse_args_fast(argv)
+
+    if args is None:
+        args = parse_args_argparse(argv)
+
+    return args
+
+
+def parse_args_fast(argv):
+    '''Parse the given command-line arguments by hand. Returns None if any
+    argument is not understood, in which case parse_args_argparse should be
+    used instead.
+    '''
+
+    args = types.SimpleNamespace(target=[],
+                                 force=False,
+                                 no_resolve=False,
+                                 args=None,
+                                 srcdir=None,
+                                 destdir=None,
+                                 platform=sys.platform)
+
+    # argparse only accepts targets as a single
+    # contiguous block of positional arguments
+    targets_done = False
+
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+
+        if arg in FLAGS:
+            setattr(args, FLAGS[arg], True)
+        elif arg in OPTIONS:
+            if i + 1 >= len(argv) or argv[i + 1].startswith('-'):
+                return None
+            i += 1
+            setattr(args, OPTIONS[arg], argv[i])
+        elif arg.startswith('-') or targets_done:
+            return None
+        else:
+            args.target.append(arg)
+            i += 1
+            continue
+
+        targets_done = len(args.target) > 0
+        i           += 1
+
+    return args
+
+
+def parse_args_argparse(argv):
+    '''Parse the given command-line arguments with argparse. '''
+
+    import argparse
+
     parser = argparse.ArgumentParser()
     parser.add_argument('target', nargs='*')
 
@@ -114,14 +202,38 @@ def parse_args(argv=None):
     return parser.parse_args(argv)
 
 
+@functools.lru_cache(maxsize=None)
 def get_python_interpreter(target):
     '''Attempts to determine whether the given target appears to be a
     Python executable. If it is, returns the path to the Python interpreter
     in the she-bang line. Otherwise returns None.
+
+    Results are cached, as the same target may be inspected more than once
+    (e.g. for "<Tool>" and "<Tool>_gui" wrappers). The cache is cleared on
+    every call to main.
     '''
 
-    with open(target, 'rb') as f:
-        header = f.read(2048).split(b'\n')
+    # Read the header with a raw file descriptor
+    # to avoid creating a buffered file object.
+    fd = os.open(target, os.O_RDONLY)
+    try:
+        header = os.read(fd, 2048)
+    finally:
+        os.close(fd)
+
+    # Both forms of python entry point (see
+    # below) begin with a she-bang, so anything
+    # else (e.g. an ELF or Mach-O binary) can
+    # be rejected immediately.
+    if header[:2] != b'#!':
+        return None
+
+    # Only the first two lines are inspected, so
+    # there is no need to split the rest. A
+    # she-bang cannot have leading whitespace,
+    # so the first line is only rstripped.
+    header = header.split(b'\n', 2)
+    h0     = header[0].rstrip()
 
     # Python entry points created by pip have two forms, and are
     # generated with distlib:
@@ -133,10 +245,8 @@ def get_python_interpreter(target):
     #
     #        #!/path/to/python
     #        ...
-    if len(header) >= 1:
-        h0 = header[0].strip()
-        if h0.startswith(b'#!') and (b'python' in h0):
-            return h0[2:].decode('utf-8')
+    if b'python' in h0:
+        return h0[2:].decode('utf-8')
 
     #  - "Contrived shebang": A script which can be executed with either
     #    python or sh, of the form:
@@ -146,7 +256,6 @@ def get_python_interpreter(target):
     #        ' '''
     #        ...
     if len(header) >= 2:
-        h0 = header[0].strip()
         h1 = header[1].strip()
         if (h0 == b'#!/bin/sh')        and \
            h1.startswith(b"'''exec' ") and \
@@ -156,37 +265,28 @@ def get_python_interpreter(target):
     return None
 
 
-def generate_wrapper(target, fsldir, extra_args, resolve):
-    '''Generate the contents of a wrapper script for the given target.'''
+def generate_wrapper(target, fsldir, extra_args, resolve, exists=None):
+    '''Generate the contents of a wrapper script for the given target.
 
-    # Python executable - run it via the
-    # specified python interpreter in
-    # isolated mode (strip leading '#!')
-    PYTHON_TEMPLATE = tw.dedent('''
-    #!/usr/bin/env bash
-    {interp} -I {target}{args} "$@"
-    ''').strip()
+    :arg exists: Whether the target exists. Checked if not provided.
+    '''
 
-    # Non-python executable - use
-    # a pass-through script
-    OTHER_TEMPLATE = tw.dedent('''
-    #!/usr/bin/env bash
-    {target}{args} "$@"
-    ''').strip()
+    if exists is None:
+        exists = op.exists(target)
 
     if extra_args is None: extra_args = ''
     else:                  extra_args = ' ' + extra_args.strip()
 
     interp   = None
-    template = OTHER_TEMPLATE
+    template = OTHER_WRAPPER_TEMPLATE
 
     # Check if this the target is a python script.
     # If the target doesn't exist (--force was used),
     # we assume that it is a non-python executable
-    if op.exists(target):
+    if exists:
         interp = get_python_interpreter(target)
         if interp is not None:
-            template = PYTHON_TEMPLATE
+            template = PYTHON_WRAPPER_TEMPLATE
 
     wrapper = template.format(interp=interp,
                               target=target,
@@ -198,8 +298,20 @@ def generate_wrapper(target, fsldir, extra_args, resolve):
     return wrapper
 
 
-def create_wrapper(target, srcdir, destdir, fsldir,
-                   platform, extra_args, resolve, force):
+def wrapper_jobs(target, srcpref, destpref, linux, force, srcfiles, planned):
+    '''Identify the wrapper script(s) that need to be created for the given
+    target. Returns a list of (target, wrapper) tuples, containing absolute
+    paths to the target executable and to the wrapper script to create.
+
+    :arg srcpref:  Source directory, with a trailing path separator.
+    :arg destpref: Destination directory, with a trailing path separator.
+    :arg linux:    True if running on Linux, False otherwise.
+    :arg srcfiles: Set containing the names of all existing files in
+                   srcdir (see list_targets). Used in place of checking
+                   the existence of each target.
+    :arg planned:  Set of wrapper paths which have already been planned.
+                   Wrappers are added to this set as they are planned.
+    '''
 
     # A wrapper script with a different
     # name to the target can be created
@@ -208,9 +320,6 @@ def create_wrapper(target, srcdir, destdir, fsldir,
     if len(target) == 2: target, wrapper = target
     else:                target, wrapper = target[0], target[0]
 
-    target  = op.join(srcdir,  target)
-    wrapper = op.join(destdir, wrapper)
-
     # Historically, FSL GUIs are named "Tool" on linux, and
     # "Tool_gui" on macOS.. In FSL ~6.0.7.5, we started naming them
     # "Tool_gui" on linux for consistency across the platforms (but
@@ -227,8 +336,7 @@ def create_wrapper(target, srcdir, destdir, fsldir,
     #   - on Linux we create two wrappers - "<Tool>" and "<Tool>_gui".
     #     The target may either be called "<Tool>" or "<Tool>_gui".
 
-    linux = platform.lower().startswith('linux')
-    gui   = linux and wrapper.endswith('_gui')
+    gui = linux and (wrapper[-GUI_SUFFIX_LEN:] == GUI_SUFFIX)
 
     # macOS or non-gui - the wrapper simply
     # has the same name as the target
@@ -239,63 +347,141 @@ def create_wrapper(target, srcdir, destdir, fsldir,
     # GUI scripts on linux - we create wrappers
     # for both "<Tool>" and "<Tool>_gui"
     else:
-        target1  = target .removesuffix('_gui')
-        wrapper1 = wrapper.removesuffix('_gui')
-        target2  = target1  + '_gui'
-        wrapper2 = wrapper1 + '_gui'
+        # The wrapper is known to end with
+        # the suffix, but the target may not
+        tgui     = target[-GUI_SUFFIX_LEN:] == GUI_SUFFIX
+        target1  = target[:-GUI_SUFFIX_LEN] if tgui else target
+        wrapper1 = wrapper[:-GUI_SUFFIX_LEN]
+        target2  = target1  + GUI_SUFFIX
+        wrapper2 = wrapper1 + GUI_SUFFIX
 
         # if $FSLDIR/bin/Tool_gui doesn't exist
         # make the Tool_gui wrapper point to
         # $FSLDIR/bin/Tool instead.
-        if not op.exists(target2):
+        if target2 not in srcfiles:
             target2 = target1
 
         targets  = [target1,  target2]
         wrappers = [wrapper1, wrapper2]
 
+    jobs = []
+
     for target, wrapper in zip(targets, wrappers):
 
         # Don't create a wrapper script if the
         # target executable does not exist.
+        if (not force) and (target not in srcfiles):
+            continue
+
+        target  = srcpref  + target
+        wrapper = destpref + wrapper
+
         # Don't create a wrapper script if it
-        # already exists.
-        if (not force) and (not op.exists(target)):  continue
-        if (not force) and (    op.exists(wrapper)): continue
+        # already exists, or if it is going
+        # to be created for an earlier target.
+        if (not force) and ((wrapper in planned) or op.exists(wrapper)):
+            continue
+
+        planned.add(wrapper)
+        jobs.append((target, wrapper))
+
+    return jobs
 
-        contents = generate_wrapper(target, fsldir, extra_args, resolve)
 
-        with open(wrapper, 'wt') as f:
-            f.write(contents)
+def list_targets(srcdir):
+    '''Returns a set containing the names of all existing entries in srcdir,
+    used in place of calling op.exists on each target. Dangling symlinks
+    are excluded, as op.exists would return False for them.
+    '''
+    names = set()
+    with os.scandir(srcdir) as entries:
+        for entry in entries:
+            # Only symlinks need to be stat'd - the
+            # type of other entries is known from
+            # the directory listing
+            if entry.is_symlink():
+                try:
+                    entry.stat()
+                except OSError:
+                    continue
+            names.add(entry.name)
+    return names
+
+
+def stat_target(target):
+    '''Returns the os.stat_result for the given target, or None if it does
+    not exist.
+    '''
+    try:
+        return os.stat(target)
+    except OSError:
+        return None
 
-        # copy permissions from target file
-        if op.exists(target): perms = os.stat(target).st_mode & 0o777
-        else:                 perms = 0o755
 
-        os.chmod(wrapper, perms)
+def write_wrapper(wrapper, contents, st):
+    '''Write contents to the wrapper script file, copying permissions from
+    the target executable.
+
+    :arg st: os.stat_result for the target, or None if it does not exist.
+    '''
+
+    # copy permissions from target file
+    if st is not None: perms = st.st_mode & 0o777
+    else:              perms = 0o755
+
+    # Create, write, and set permissions on the
+    # wrapper via a single file descriptor. fchmod
+    # is needed as the mode passed to os.open is
+    # subject to the umask, and is ignored if the
+    # wrapper already exists (e.g. with --force).
+    # O_CLOEXEC ensures that the descriptor is
+    # never leaked into a child process.
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC
+    fd    = os.open(wrapper, flags, perms)
+    try:
+        os.write(fd, contents.encode('utf-8'))
+        os.fchmod(fd, perms)
+    finally:
+        os.close(fd)
 
 
 def main(argv=None):
 
-    args   = parse_args(argv)
-    fsldir = os.environ.get('FSLDIR', None)
-    prefix = os.environ.get('PREFIX', None)
+    # Targets may have changed since
+    # a previous call to main
+    get_python_interpreter.cache_clear()
 
-    if fsldir is not None: fsldir = op.realpath(op.abspath(fsldir))
-    if prefix is not None: prefix = op.realpath(op.abspath(prefix))
+    args = parse_args(argv)
 
     # Only create wrappers if the FSL_CREATE_WRAPPER_SCRIPTS
-    # environment variable is set
+    # environment variable is set. This is checked before
+    # anything else, as this script is called by the post-
+    # link script of every FSL package, including when FSL
+    # is not being installed by the fslinstaller.
     if not args.force:
         if 'FSL_CREATE_WRAPPER_SCRIPTS' not in os.environ:
             return 0
 
+    fsldir = os.environ.get('FSLDIR', None)
+    prefix = os.environ.get('PREFIX', None)
+
+    if fsldir is not None: fsldir = op.realpath(fsldir)
+    if prefix is not None: prefix = op.realpath(prefix)
+
     # Only create wrappers if FSLDIR
     # exists and if PREFIX is equal to
-    # or is within FSLDIR
-    if fsldir is None                or \
-       prefix is None                or \
-       not op.exists(fsldir)         or \
-       not prefix.startswith(fsldir):
+    # or is within FSLDIR. All paths are
+    # compared against the same FSLDIR
+    # prefix, so we slice rather than
+    # calling startswith each time, and do
+    # the string comparison before the
+    # (more expensive) existence check.
+    if fsldir is None or prefix is None:
+        return 0
+
+    fsllen = len(fsldir)
+
+    if prefix[:fsllen] != fsldir or not op.exists(fsldir):
         return 0
 
     # Names of all executables for which wrapper
@@ -315,14 +501,45 @@ def main(argv=None):
 
     # Source and destination directories
     # must be located inside $FSLDIR
-    if not (destdir.startswith(fsldir) and srcdir.startswith(fsldir)):
+    if destdir[:fsllen] != fsldir or srcdir[:fsllen] != fsldir:
         return 1
 
     os.makedirs(destdir, exist_ok=True)
 
+    # Platform and the contents of the source
+    # directory are the same for all targets,
+    # so are only looked up once.
+    linux = args.platform.lower().startswith('linux')
+
+    if op.isdir(srcdir): srcfiles = list_targets(srcdir)
+    else:                srcfiles = set()
+
+    # Target and wrapper paths are built by
+    # concatenation onto these prefixes. op.join
+    # is used so that a directory which already
+    # has a trailing separator is left as-is.
+    srcpref  = op.join(srcdir,  '')
+    destpref = op.join(destdir, '')
+
+    # Identify all wrappers to be created,
+    # generate their contents, and then
+    # write them all out.
+    jobs    = []
+    planned = set()
     for target in targets:
-        create_wrapper(target, srcdir, destdir, fsldir, args.platform,
-                       args.args, not args.no_resolve, args.force)
+        jobs.extend(wrapper_jobs(target, srcpref, destpref, linux,
+                                 args.force, srcfiles, planned))
+
+    # Each target is stat'd once - the result
+    # is used both to decide whether it may be
+    # a python script, and for its permissions
+    stats    = [stat_target(target) for target, _ in jobs]
+    contents = [generate_wrapper(target, fsldir, args.args,
+                                 not args.no_resolve, st is not None)
+                for (target, _), st in zip(jobs, stats)]
+
+    for (_, wrapper), content, st in zip(jobs, contents, stats):
+        write_wrapper(wrapper, content, st)
 
     return 0
 
@@ -31,9 +31,11 @@ import                   argparse
 import                   collections
 import                   contextlib
 import                   datetime
+import                   errno
 import                   fnmatch
 import                   getpass
 import                   hashlib
+import                   io
 import                   json
 import                   locale
 import                   logging
@@ -51,6 +53,7 @@ import                   tempfile
 import                   threading
 import                   time
 import                   traceback
+import                   zlib
 
 try:
     import urllib.request as urlrequest
@@ -72,6 +75,9 @@ except ImportError: from HTMLParser  import HTMLParser
 try:                from http.cookiejar import CookieJar
 except ImportError: from cookielib      import CookieJar
 
+try:                from shlex import quote as shquote
+except ImportError: from pipes import quote as shquote
+
 
 PYVER = sys.version_info[:2]
 
@@ -118,6 +124,11 @@ internal/development FSL releases. See the download_dev_releases function
 for more details.
 """
 
+PARALLEL_DOWNLOAD_THRESHOLD = 33554432
+"""Files larger than this (in bytes) are downloaded in parallel byte ranges,
+if the server supports HTTP range requests. See the download_file function.
+"""
+
 TEMPLATE_IDENTIFIER = '%%%%%%%%%%%%%'
 """String used when generating the standalone fslinstaller.py script to identify
 content that is to be inserted. See the .ci/new_release.py script.
@@ -182,7 +193,7 @@ def get_terminal_width(fallback=None):
         pass
 
     try:
-        result = Process.check_output('tput cols', log_output=False)
+        result = Process.check_output(['tput', 'cols'], log_output=False)
         return int(result.strip())
     except Exception:
         return fallback
@@ -231,6 +242,7 @@ def printmsg(*args, **kwargs):
     logmsg   = kwargs.pop('log',  True)
     fill     = kwargs.pop('fill', True)
 
+    reset    = ANSICODES[RESET]
     coded    = ''
     uncoded  = ''
 
@@ -241,11 +253,9 @@ def printmsg(*args, **kwargs):
             slc = slice(idx + 1, blockids[i + 1])
 
         msg      = args[idx]
-        msgcodes = args[slc]
-        msgcodes = [ANSICODES[c] for c in msgcodes]
-        msgcodes = ''.join(msgcodes)
+        msgcodes = ansi_prefix(*args[slc])
         uncoded += msg
-        coded   += '{}{}{}'.format(msgcodes, msg, ANSICODES[RESET])
+        coded   += msgcodes + msg + reset
 
     if len(blockids) > 0:
 
@@ -358,24 +368,33 @@ def send_registration_info(url, data):
 
 
 def funccache(func):
-    """Memoisation decorator for a function. Alternative to
-    ``functools.lru_cache``, which is not available in Python 2.x.
+    """Memoisation decorator for a function. Uses ``functools.lru_cache``
+    where available, or a pure-python equivalent on Python 2.x. The
+    decorated function has a ``reset`` method which clears the cache.
     """
 
-    cache = {}
+    # python 3 - use the C implementation
+    if hasattr(ft, 'lru_cache'):
+        decorator       = ft.lru_cache(maxsize=None)(func)
+        decorator.reset = decorator.cache_clear
+        return decorator
 
-    def decorator(*args, **kwargs):
+    cache   = {}
+    missing = object()
 
-        key = list()
-        key.extend(args)
-        key.extend([kwargs[k] for k in sorted(kwargs.keys())])
+    @ft.wraps(func)
+    def decorator(*args, **kwargs):
 
-        if len(key) > 0: key = tuple(key)
-        else:            key = ('default',)
+        # kwargs are keyed by name, so that
+        # f(a=1) and f(b=1) do not collide
+        if kwargs: key = (args, tuple(sorted(kwargs.items())))
+        else:      key = args
 
-        value = cache.get(key, None)
+        # Use a sentinel rather than None, so
+        # that None return values are cached
+        value = cache.get(key, missing)
 
-        if value is None:
+        if value is missing:
             value      = func(*args, **kwargs)
             cache[key] = value
 
@@ -389,6 +408,14 @@ def funccache(func):
     return decorator
 
 
+@funccache
+def ansi_prefix(*msgtypes):
+    """Returns the combined ANSI escape sequence for the given message types
+    (e.g. INFO, EMPHASIS). Used by printmsg.
+    """
+    return ''.join([ANSICODES[t] for t in msgtypes])
+
+
 def identify_platform():
     """Figures out what platform we are running on. Returns a platform
     identifier string - one of:
@@ -439,17 +466,28 @@ def getlocale():
     return locale_str
 
 
+CUDA_VERSION_PATTERN = re.compile(r'CUDA Version: (\d+)\.(\d+)')
+"""Pattern used by identify_cuda to find the CUDA version in the output of
+nvidia-smi.
+"""
+
+
 @funccache
 def identify_cuda(device=None):
     """Tries to call nvidia-smi to interrogate the supported CUDA runtime
     version for the specified device (default: 0).
 
-    If nvidia-smi cannot be called, returns None.
+    If nvidia-smi cannot be called, or we are running on macOS, returns None.
 
     Otherwise returns the latest CUDA version supported by the driver, as a
     tuple of (major, minor) ints.
     """
 
+    # There are no CUDA drivers for macOS, so
+    # don't bother trying to run nvidia-smi
+    if platform.system().lower() == 'darwin':
+        return None
+
     if device is None:
         device = 0
 
@@ -467,16 +505,10 @@ def identify_cuda(device=None):
     cudaver = None
 
     try:
-        output = Process.check_output('nvidia-smi -i {}'.format(device))
-        output = output.split('\n')
-        pat    = r'CUDA Version: (\S+)'
-        for line in output:
-            match = re.search(pat, line)
-            if match:
-                cudaver      = match.group(1)
-                major, minor = cudaver.split('.')
-                cudaver      = (int(major),  int(minor))
-                break
+        output = Process.check_output(['nvidia-smi', '-i', str(device)])
+        match  = CUDA_VERSION_PATTERN.search(output)
+        if match:
+            cudaver = (int(match.group(1)), int(match.group(2)))
 
     except Exception as e:
         log.debug('Unable to interrogate CUDA version: %s', e, exc_info=True)
@@ -487,8 +519,20 @@ def identify_cuda(device=None):
 
 def check_need_admin(dirname):
     """Returns True if dirname needs administrator privileges to write to,
-    False otherwise.
+    False otherwise. If dirname does not exist, its nearest existing
+    ancestor is checked, as that is where it will be created.
     """
+
+    if os.getuid() == 0:
+        return False
+
+    dirname = op.abspath(dirname)
+    while not op.exists(dirname):
+        parent = op.dirname(dirname)
+        if parent == dirname:
+            break
+        dirname = parent
+
     # os.supports_effective_ids added in
     # python 3.3, so can't be used here
     return not os.access(dirname, os.W_OK | os.X_OK)
@@ -503,9 +547,13 @@ def get_admin_password(action='install FSL'):
     :returns:    the validated administrator password
     """
 
+    # Call sudo directly rather than via
+    # Process.sudo_popen, as we don't need
+    # its environment-propagating wrapper
+    # script just to run "true".
     def validate_admin_password(password):
-        proc = Process.sudo_popen(['true'], password, stdin=sp.PIPE)
-        proc.communicate()
+        proc = sp.Popen(['sudo', '-S', '-k', 'true'], stdin=sp.PIPE)
+        proc.communicate('{}\n'.format(password).encode())
         return proc.returncode == 0
 
     msg = 'Your administrator password is needed to {}'.format(action)
@@ -573,6 +621,52 @@ def tempdir(override_dir=None, change_into=True, delete=True):
             shutil.rmtree(tmpdir)
 
 
+@contextlib.contextmanager
+def background_writer(write, maxsize=4):
+    """Returns a context manager which calls write on a separate thread.
+    The context manager yields a function which queues data to be passed
+    to write. At most maxsize blocks of data are queued at any one time.
+
+    If write raises an error, it is re-raised on the next call to the
+    yielded function, or when the context manager exits.
+    """
+
+    blocks = queue.Queue(maxsize=maxsize)
+    errors = []
+
+    def writer():
+        while True:
+            block = blocks.get()
+            if block is None:
+                break
+            # keep draining the queue after an
+            # error, so that put doesn't block
+            if errors:
+                continue
+            try:
+                write(block)
+            except Exception as e:
+                errors.append(e)
+
+    def put(block):
+        if errors:
+            raise errors[0]
+        blocks.put(block)
+
+    thread        = threading.Thread(target=writer)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        yield put
+    finally:
+        blocks.put(None)
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+
 def warn_on_error(*msgargs, **msgkwargs):
     """Decorator which tries to run a function, and prints a message if it
     fails. The arguments after the function are passed to the printmsg
@@ -703,20 +797,38 @@ def tempfilename(permissions=None, delete=True):
             os.remove(fname)
 
 
-def sha256(filename, check_against=None, blocksize=1048576):
+def hash_file(f, hashobj, blocksize=1048576):
+    """Update hashobj with the contents of the file-like object f, which
+    must be opened in binary mode. Returns hashobj.
+    """
+    read = f.read
+    while True:
+        block = read(blocksize)
+        if len(block) == 0:
+            break
+        hashobj.update(block)
+    return hashobj
+
+
+def sha256(filename, check_against=None, blocksize=1048576, hashobj=None):
     """Calculate the SHA256 checksum of the given file. If check_against
     is provided, it is compared against the calculated checksum, and an
     error is raised if they are not the same.
+
+    If hashobj is provided, it is assumed to be a hashlib.sha256 object
+    which has already been updated with the file contents (e.g. by
+    download_file), so the file is not read.
     """
 
-    hashobj = hashlib.sha256()
+    if hashobj is None:
+        with open(filename, 'rb') as f:
 
-    with open(filename, 'rb') as f:
-        while True:
-            block = f.read(blocksize)
-            if len(block) == 0:
-                break
-            hashobj.update(block)
+            # python >= 3.11 - hash the file in C
+            if hasattr(hashlib, 'file_digest'):
+                hashobj = hashlib.file_digest(f, 'sha256')
+
+            else:
+                hashobj = hash_file(f, hashlib.sha256(), blocksize)
 
     checksum = hashobj.hexdigest()
 
@@ -818,24 +930,13 @@ def install_environ(fsldir, username=None, password=None, cuda_version=None):
     return env
 
 
-def download_file(url,
-                  destination,
-                  progress=None,
-                  blocksize=131072,
-                  ssl_verify=True):
-    """Download a file from url, saving it to destination. """
-
-    def default_progress(downloaded, total):
-        pass
-
-    if progress is None:
-        progress = default_progress
-
-    log.debug('Downloading %s ...', url)
-
-    # Path to local file
-    if op.exists(url):
-        url = 'file:' + urlrequest.pathname2url(op.abspath(url))
+@funccache
+def urlopen_kwargs(ssl_verify=True):
+    """Returns a dict of keyword arguments to pass to urlopen. If ssl_verify
+    is False, the dict contains an unconfigured SSL context, which disables
+    SSL verification. The result is cached, so the SSL context is created,
+    and the user is warned, only once.
+    """
 
     # We create and use an unconfigured SSL
     # context to disable SSL verification.
@@ -868,6 +969,150 @@ def download_file(url,
             sslctx.verify_mode    = ssl.CERT_NONE
             kwargs['context']     = sslctx
 
+    return kwargs
+
+
+def download_file_ranges(url,
+                         destination,
+                         total,
+                         progress,
+                         blocksize=1048576,
+                         nranges=8,
+                         **kwargs):
+    """Download a file from url in nranges parallel byte ranges, saving it
+    to destination. Used by download_file for large files served by a
+    server which supports HTTP range requests.
+
+    :arg url:         URL to download
+    :arg destination: File to save to
+    :arg total:       Total file size in bytes
+    :arg progress:    Progress function, called from the calling thread
+    :arg blocksize:   Number of bytes to read at a time
+    :arg nranges:     Number of ranges to download in parallel
+    :returns:         True if the download succeeded, False if the server
+                      did not honour a range request, sent a different
+                      range to the one requested, or a range failed, in
+                      which case the caller should fall back to a serial
+                      download.
+    """
+
+    lock       = threading.Lock()
+    downloaded = [0]
+    failed     = []
+    rangesize  = (total + nranges - 1) // nranges
+    ranges     = [(start, min(start + rangesize, total) - 1)
+                  for start in range(0, total, rangesize)]
+
+    def worker(start, end):
+        resp = None
+        try:
+            headers = {'User-Agent' : 'Mozilla/5.0',
+                       'Range'      : 'bytes={}-{}'.format(start, end)}
+            req     = urlrequest.Request(url, headers=headers)
+            resp    = urlrequest.urlopen(req, **kwargs)
+
+            # Server has ignored the Range header
+            # and is sending us the whole file
+            if resp.getcode() != 206:
+                failed.append(None)
+                return
+
+            # Or has sent us a different range
+            # to the one that we asked for
+            crange = resp.headers.get('content-range', '')
+            if not crange.startswith('bytes {}-{}/'.format(start, end)):
+                log.debug('Unexpected Content-Range for range %i-%i '
+                          'of %s: %s', start, end, url, crange)
+                failed.append(None)
+                return
+
+            offset = start
+            read   = resp.read
+            with open(destination, 'r+b') as outf:
+                outf.seek(start)
+                write = outf.write
+                while not failed:
+                    block = read(blocksize)
+                    if len(block) == 0:
+                        break
+                    offset += len(block)
+                    write(block)
+                    with lock:
+                        downloaded[0] += len(block)
+
+            if offset != end + 1:
+                failed.append(None)
+
+        except Exception as e:
+            log.debug('Error downloading range %i-%i of %s: %s',
+                      start, end, url, e, exc_info=True)
+            failed.append(e)
+        finally:
+            if resp:
+                resp.close()
+
+    # Pre-size the destination so that each
+    # worker can write into its own region
+    with open(destination, 'wb') as outf:
+        outf.truncate(total)
+
+    threads = [threading.Thread(target=worker, args=r) for r in ranges]
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    # The progress function is not necessarily
+    # thread-safe, so we call it from here
+    progress(0, total)
+    for t in threads:
+        while t.is_alive():
+            t.join(0.25)
+            progress(downloaded[0], total)
+
+    # The last thread may have finished before
+    # its first join, so report the final total
+    progress(downloaded[0], total)
+
+    return len(failed) == 0
+
+
+def download_file(url,
+                  destination,
+                  progress=None,
+                  blocksize=1048576,
+                  ssl_verify=True,
+                  nranges=8,
+                  headers=None,
+                  hashobj=None):
+    """Download a file from url, saving it to destination, which may be
+    either a file path, or a file-like object opened in binary mode.
+    Additional request headers may be passed via the headers argument.
+    The response headers are returned. If the response is gzip-encoded
+    (i.e. the caller sent "Accept-Encoding: gzip"), it is decompressed.
+
+    If hashobj is provided (e.g. a hashlib.sha256 object), it is updated
+    with the downloaded data as it is received, so that the file does not
+    need to be read again to calculate its checksum (see sha256). The
+    exception is a parallel ranged download, where the ranges arrive out
+    of order, so the file is read back once it is complete.
+
+    Large files (see PARALLEL_DOWNLOAD_THRESHOLD) are downloaded in
+    nranges parallel byte ranges if the server supports HTTP range
+    requests, and destination is a file path. Pass nranges=1 to disable
+    this.
+    """
+
+    def default_progress(downloaded, total):
+        pass
+
+    log.debug('Downloading %s ...', url)
+
+    # Path to local file
+    if op.exists(url):
+        url = 'file:' + urlrequest.pathname2url(op.abspath(url))
+
+    kwargs = urlopen_kwargs(ssl_verify)
+
     # py2: urlopen result cannot be used as a
     # context manager, so we use try-finally
     # to ensure that the connection is closed
@@ -878,30 +1123,227 @@ def download_file(url,
 
         # Some servers reject requests originating
         # from urllib, so we pretend to be firefox
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        req     = urlrequest.Request(url, headers=headers)
-        resp    = urlrequest.urlopen(req, **kwargs)
+        reqhdrs = {'User-Agent': 'Mozilla/5.0'}
+        reqhdrs.update(headers or {})
+        req      = urlrequest.Request(url, headers=reqhdrs)
+        resp     = urlrequest.urlopen(req, **kwargs)
+        resphdrs = resp.headers
+
+        try:             total = int(resp.headers['content-length'])
+        except KeyError: total = None
+
+        # Transparently decompress responses if
+        # the caller asked for gzip encoding
+        # (see download_manifest). Progress is
+        # reported in terms of compressed bytes.
+        if resphdrs.get('content-encoding', '') == 'gzip':
+            decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            decomp = None
+
+        ranged = (nranges > 1                                       and
+                  decomp is None                                    and
+                  isstr(destination)                                and
+                  total is not None                                 and
+                  total >= PARALLEL_DOWNLOAD_THRESHOLD              and
+                  urlparse.urlparse(url).scheme in ('http', 'https') and
+                  resp.headers.get('accept-ranges', '') == 'bytes')
 
-        with open(destination, 'wb') as outf:
+        if ranged:
+            resp.close()
+            resp = None
+            if download_file_ranges(url, destination, total,
+                                    progress or default_progress,
+                                    blocksize, nranges, **kwargs):
+                # Ranges arrive out of order, so
+                # we have to hash the file afterwards
+                if hashobj is not None:
+                    with open(destination, 'rb') as f:
+                        hash_file(f, hashobj, blocksize)
+                return resphdrs
+            log.debug('Parallel download of %s failed - falling back '
+                      'to serial download', url)
+            resp = urlrequest.urlopen(req, **kwargs)
+
+        if isstr(destination): outf = open(destination, 'wb')
+        else:                  outf = destination
+
+        try:
+            # No progress reporting - let
+            # shutil do the copy for us
+            if progress is None and decomp is None and hashobj is None:
+                shutil.copyfileobj(resp, outf, blocksize)
+                return resphdrs
 
-            try:             total = int(resp.headers['content-length'])
-            except KeyError: total = None
+            if progress is None:
+                progress = default_progress
 
+            read       = resp.read
             downloaded = 0
 
-            progress(downloaded, total)
-            while True:
-                block = resp.read(blocksize)
-                if len(block) == 0:
-                    break
-                downloaded += len(block)
-                outf.write(block)
+            # Write to the destination on a separate
+            # thread, so that network reads can overlap
+            # with disk writes (e.g. to a slow network
+            # file system).
+            with background_writer(outf.write) as write:
                 progress(downloaded, total)
+                while True:
+                    block = read(blocksize)
+                    if len(block) == 0:
+                        break
+                    downloaded += len(block)
+                    if decomp is not None:
+                        block = decomp.decompress(block)
+                    if hashobj is not None:
+                        hashobj.update(block)
+                    write(block)
+                    progress(downloaded, total)
+
+                if decomp is not None:
+                    block = decomp.flush()
+                    if hashobj is not None:
+                        hashobj.update(block)
+                    write(block)
+        finally:
+            if outf is not destination:
+                outf.close()
 
     finally:
         if resp:
             resp.close()
 
+    return resphdrs
+
+
+def background_download(url, destination, **kwargs):
+    """Starts downloading url to destination (via download_file) on a
+    separate thread. Returns a function which waits for the download to
+    finish, and then returns a hashlib.sha256 object containing the checksum
+    of the downloaded data. If the download failed, the error is re-raised
+    by the returned function.
+
+    All keyword arguments are passed through to download_file.
+    """
+
+    hashobj = hashlib.sha256()
+    errors  = []
+
+    def download():
+        try:
+            download_file(url, destination, hashobj=hashobj, **kwargs)
+        except Exception as e:
+            errors.append(e)
+
+    thread        = threading.Thread(target=download)
+    thread.daemon = True
+    thread.start()
+
+    def wait():
+        thread.join()
+        if errors:
+            raise errors[0]
+        return hashobj
+
+    return wait
+
+
+def cache_dir():
+    """Returns the directory used to cache downloaded files -
+    $XDG_CACHE_HOME/fslinstaller/, or ~/.cache/fslinstaller/. Returns None
+    if caching has been disabled by setting $FSLINSTALLER_NO_CACHE to 1.
+    The directory is not created. See download_manifest and self_update.
+    """
+    if os.environ.get('FSLINSTALLER_NO_CACHE') == '1':
+        return None
+    cachedir = os.environ.get('XDG_CACHE_HOME')
+    if not cachedir:
+        # As in parse_args, we use getpwuid rather
+        # than op.expanduser, as the latter returns
+        # the calling user's home directory under
+        # sudo on macOS, and we don't want to
+        # create root-owned files in there.
+        homedir  = pwd.getpwuid(os.getuid()).pw_dir
+        cachedir = op.join(homedir, '.cache')
+    return op.join(cachedir, 'fslinstaller')
+
+
+def manifest_cache_prefix(url):
+    """Returns a file path prefix used to cache the manifest downloaded from
+    url, or None if the manifest at url should not be cached (i.e. it is not
+    a http(s) URL, or caching is disabled). See download_manifest.
+
+    The manifest is saved to <prefix>.json, and its ETag and Last-Modified
+    response headers are saved to <prefix>.etag. See cache_dir.
+    """
+    cachedir = cache_dir()
+    if cachedir is None:
+        return None
+    if urlparse.urlparse(url).scheme not in ('http', 'https'):
+        return None
+    key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+    return op.join(cachedir, 'manifest-{}'.format(key))
+
+
+def read_manifest_cache(url):
+    """Returns a tuple containing (data, etag, last-modified) for the cached
+    copy of the manifest at url, or None if there is no cached copy. See
+    manifest_cache_prefix.
+    """
+    prefix = manifest_cache_prefix(url)
+    if prefix is None:
+        return None
+    try:
+        with open(prefix + '.json', 'rb') as f:
+            data = f.read()
+        with open(prefix + '.etag', 'rt') as f:
+            etag, modified = (f.read().split('\n') + ['', ''])[:2]
+    except Exception:
+        return None
+    return data, etag, modified
+
+
+def write_manifest_cache(url, data, headers):
+    """Saves a copy of the manifest at url, along with its ETag and
+    Last-Modified response headers. Failures are logged and ignored.
+    See manifest_cache_prefix.
+    """
+    prefix = manifest_cache_prefix(url)
+    if prefix is None:
+        return
+
+    etag     = headers.get('etag',          '') or ''
+    modified = headers.get('last-modified', '') or ''
+
+    # Nothing to revalidate against
+    if not (etag or modified):
+        return
+
+    try:
+        cachedir = op.dirname(prefix)
+        if not op.exists(cachedir):
+            os.makedirs(cachedir)
+
+        # Write to temp files and rename, so
+        # that a concurrent installer never
+        # sees a partially written cache
+        for suffix, content in [('.json', data),
+                                ('.etag', '{}\n{}'.format(etag, modified))]:
+            if not isinstance(content, bytes):
+                content = content.encode('utf-8')
+            fd, tmpf = tempfile.mkstemp(dir=cachedir)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            os.rename(tmpf, prefix + suffix)
+    except Exception as e:
+        log.debug('Could not cache manifest from %s: %s', url, e,
+                  exc_info=True)
+
+
+MANIFEST_COMMENT_PATTERN = re.compile(r'^[ \t]*//[^\n]*', re.MULTILINE)
+"""Pattern used by download_manifest to remove comment lines (lines beginning
+with a double-forward slash) from the manifest file.
+"""
+
 
 def download_manifest(url, workdir=None, **kwargs):
     """Downloads the installer manifest file, which contains information
@@ -915,27 +1357,50 @@ def download_manifest(url, workdir=None, **kwargs):
 
     This function modifies the manifest structure by adding a 'version'
     attribute to all FSL build entries.
+
+    The manifest is downloaded into memory. If workdir is provided, a copy
+    is saved to workdir/manifest.json.
+
+    Manifests downloaded from a http(s) URL are cached on disk, and
+    subsequent calls send a conditional request, so the manifest is only
+    downloaded again if it has changed. See manifest_cache_prefix.
     """
 
     log.debug('Downloading FSL installer manifest from %s', url)
 
-    with tempdir(workdir):
+    # The manifest is plain JSON, so is
+    # highly compressible. download_file
+    # will decompress it for us.
+    cached  = read_manifest_cache(url)
+    headers = {'Accept-Encoding' : 'gzip'}
+    if cached is not None:
+        data, etag, modified = cached
+        if etag:     headers['If-None-Match']     = etag
+        if modified: headers['If-Modified-Since'] = modified
 
-        try:
-            download_file(url, 'manifest.json', **kwargs)
-        except Exception as e:
+    try:
+        buf      = io.BytesIO()
+        resphdrs = download_file(url, buf, headers=headers, **kwargs)
+        data     = buf.getvalue()
+        write_manifest_cache(url, data, resphdrs)
+    except Exception as e:
+        # 304 Not Modified - use cached copy
+        if cached is not None and getattr(e, 'code', None) == 304:
+            log.debug('FSL release manifest at %s has not changed - '
+                      'using cached copy', url)
+        else:
             log.debug('Error downloading FSL release manifest from %s',
                       url, exc_info=True)
             raise Exception('Unable to download FSL release manifest '
                             'from {} [{}]!'.format(url, str(e)))
 
-        with open('manifest.json') as f:
-            lines = f.readlines()
+    if workdir is not None:
+        with open(op.join(workdir, 'manifest.json'), 'wb') as f:
+            f.write(data)
 
     # Drop comments
-    lines = [l for l in lines if not l.lstrip().startswith('//')]
-
-    manifest = json.loads('\n'.join(lines))
+    text     = MANIFEST_COMMENT_PATTERN.sub('', data.decode('utf-8'))
+    manifest = json.loads(text)
 
     # Add "version" to every build
     for version, builds in manifest['versions'].items():
@@ -959,7 +1424,8 @@ def download_dev_releases(url, workdir=None, **kwargs):
 
     The list is sorted by date, newest first.
 
-    Keyword arguments are passed through to the download_file function.
+    Keyword arguments are passed through to the download_file function. If
+    workdir is provided, a copy of the file is saved to it.
     """
 
     # parse a dev manifest file name, returning
@@ -995,25 +1461,34 @@ def download_dev_releases(url, workdir=None, **kwargs):
     # list of (url, version, commit, branch)
     devreleases = []
 
-    with tempdir(workdir):
+    # Download into memory rather than into a
+    # temporary directory, to avoid changing
+    # the working directory
+    try:
+        buf = io.BytesIO()
+        download_file(url, buf, **kwargs)
+    except Exception as e:
+        log.debug('Error downloading devreleases.txt from %s',
+                  url, exc_info=True)
+        raise Exception('Unable to download development manifest '
+                        'list from {}!'.format(url))
+
+    data = buf.getvalue()
 
-        try:
-            download_file(url, 'devreleases.txt', **kwargs)
-        except Exception as e:
-            log.debug('Error downloading devreleases.txt from %s',
-                      url, exc_info=True)
-            raise Exception('Unable to download development manifest '
-                            'list from {}!'.format(url))
+    if workdir is not None:
+        with open(op.join(workdir, 'devreleases.txt'), 'wb') as f:
+            f.write(data)
 
-        with open('devreleases.txt', 'rt') as f:
-            urls = f.read().strip().split('\n')
-            urls = [l.strip() for l in urls]
+    urls = data.decode('utf-8').strip().split('\n')
+    urls = [l.strip() for l in urls]
 
-        for url in urls:
-            devreleases.append([url] + parse_devrelease_name(url))
+    for url in urls:
+        devreleases.append([url] + parse_devrelease_name(url))
 
     # sort by version, newest first
-    return sorted(devreleases, key=lambda r: Version(r[1]), reverse=True)
+    return sorted(devreleases,
+                  key=lambda r: parse_version(r[1]),
+                  reverse=True)
 
 
 class Progress(object):
@@ -1039,7 +1514,8 @@ class Progress(object):
                  width=None,
                  proglabel='progress',
                  progfile=None,
-                 prefix=None):
+                 prefix=None,
+                 interval=None):
         """Create a Progress reporter.
 
         :arg label:     Units (e.g. "MB", "%",)
@@ -1054,8 +1530,8 @@ class Progress(object):
 
         :arg width:     Maximum width, if a progress bar is displayed. Default
                         is to automatically infer the terminal width (see
-                        get_terminal_width). Not applied to count/spin
-                        displays.
+                        get_terminal_width) when the first progress bar is
+                        displayed. Not applied to count/spin displays.
 
         :arg proglabel: Label to use when writing progress updates to progfile.
 
@@ -1065,6 +1541,11 @@ class Progress(object):
                         <proglabel> <value>[ <total>]
 
         :arg prefix:    Text to display before the progress bar
+
+        :arg interval:  Minimum time in seconds between successive updates.
+                        Updates which arrive sooner are dropped, except for
+                        the final update (when value >= total). Default is
+                        to display every update.
         """
 
         if transform is None:
@@ -1081,6 +1562,10 @@ class Progress(object):
         self.proglabel = proglabel
         self.progfile  = progfile
         self.prefix    = prefix
+        self.interval  = interval
+
+        # used by the update function
+        self.__last_update = None
 
         # used by the spin function
         self.__last_spin = None
@@ -1123,6 +1608,20 @@ class Progress(object):
         if total is None:
             total = self.total
 
+        # Rate-limit updates, as each one
+        # involves several terminal writes
+        # and appending to the progfile
+        if self.interval:
+            now   = time.time()
+            final = (value is not None and
+                     total is not None and
+                     value >= total)
+            if not final                      and \
+               self.__last_update is not None and \
+               now - self.__last_update < self.interval:
+                return
+            self.__last_update = now
+
         value, total = self.transform(value, total)
 
         if value is None and total is None:
@@ -1167,9 +1666,14 @@ class Progress(object):
         value = min(value, total)
 
         # arbitrary fallback of 50 columns if
-        # terminal width cannot be determined
-        if self.width is None: width = get_terminal_width(50)
-        else:                  width = self.width
+        # terminal width cannot be determined.
+        # The width is only queried once, as
+        # get_terminal_width may need to run
+        # tput.
+        if self.width is None:
+            self.width = get_terminal_width(50)
+
+        width = self.width
 
         fvalue = self.fmt(value)
         ftotal = self.fmt(total)
@@ -1212,12 +1716,14 @@ class Process(object):
                  log_output=True,
                  print_output=False,
                  append_env=None,
+                 queue_output=True,
                  **kwargs):
         """Run the specified command. Starts threads to capture stdout and
         stderr.
 
-        :arg cmd:          Command to run - passed through shlex.split, then
-                           passed to subprocess.Popen
+        :arg cmd:          Command to run - either a string, which is passed
+                           through shlex.split, or a pre-split list of
+                           arguments. Passed to subprocess.Popen.
 
         :arg admin:        Run the command with administrative privileges
 
@@ -1233,6 +1739,11 @@ class Process(object):
         :arg append_env:   Dictionary of additional environment to be set when
                            the command is run.
 
+        :arg queue_output: If True (default), stdout/stderr lines are pushed
+                           onto the stdoutq/stderrq queues. Pass False if
+                           the output will not be read, so that it is not
+                           accumulated in memory.
+
         :arg kwargs:       Passed to subprocess.Popen
         """
 
@@ -1246,14 +1757,17 @@ class Process(object):
         self.popen = Process.popen(cmd, admin, password,
                                    append_env=append_env, **kwargs)
 
+        if queue_output: stdoutq, stderrq = self.stdoutq, self.stderrq
+        else:            stdoutq, stderrq = None,         None
+
         # threads for consuming stdout/stderr
         self.stdout_thread = threading.Thread(
             target=Process.forward_stream,
-            args=(self.popen.stdout, self.stdoutq, cmd,
+            args=(self.popen.stdout, stdoutq, cmd,
                   'stdout', log_output, print_output))
         self.stderr_thread = threading.Thread(
             target=Process.forward_stream,
-            args=(self.popen.stderr, self.stderrq, cmd,
+            args=(self.popen.stderr, stderrq, cmd,
                   'stderr', log_output, print_output))
 
         self.stdout_thread.daemon = True
@@ -1289,7 +1803,7 @@ class Process(object):
         is raised if the process returns a non-zero exit code, unless a keyword
         argument `check=False` is specified.
 
-        :arg cmd: The command to run, as a string
+        :arg cmd: The command to run, as a string or list of arguments
         """
 
         check = kwargs.pop('check', True)
@@ -1298,16 +1812,17 @@ class Process(object):
         proc.wait()
 
         if check and (proc.returncode != 0):
-            raise RuntimeError('This command returned an error: ' + cmd)
+            raise RuntimeError(
+                'This command returned an error: {}'.format(cmd))
 
-        stdout = ''
+        stdout = []
         while True:
             try:
-                stdout += proc.stdoutq.get_nowait()
+                stdout.append(proc.stdoutq.get_nowait())
             except queue.Empty:
                 break
 
-        return stdout
+        return ''.join(stdout)
 
 
     @staticmethod
@@ -1317,16 +1832,21 @@ class Process(object):
         non-zero exit code, unless a keyword argument `check=False` is
         specified.
 
-        :arg cmd: The command to run, as a string
+        :arg cmd: The command to run, as a string or list of arguments
         """
 
+        # Output is logged, but not returned,
+        # so there is no need to accumulate it
+        kwargs.setdefault('queue_output', False)
+
         check = kwargs.pop('check', True)
         proc  = Process(cmd, *args, **kwargs)
 
         proc.wait()
 
         if check and proc.returncode != 0:
-            raise RuntimeError('This command returned an error: ' + cmd)
+            raise RuntimeError(
+                'This command returned an error: {}'.format(cmd))
 
         return proc.returncode
 
@@ -1337,7 +1857,8 @@ class Process(object):
         assumption that cmd will produce "total" number of lines of output.
 
         :arg cmd:       The commmand to run as a string, or a sequence of
-                        multiple commands.
+                        multiple commands, each of which may be a string
+                        or a pre-split list of arguments.
 
         :arg total:     Total number of lines of standard output to expect.
 
@@ -1370,9 +1891,12 @@ class Process(object):
         if progfunc is None:
             nlines = [0]
             def progfunc(proc):
+                # Count all lines emitted
+                # since the last refresh
                 try:
-                    _         = proc.stdoutq.get_nowait()
-                    nlines[0] = nlines[0] + 1
+                    while True:
+                        _         = proc.stdoutq.get_nowait()
+                        nlines[0] = nlines[0] + 1
                 except queue.Empty:
                     pass
                 return nlines[0]
@@ -1395,7 +1919,18 @@ class Process(object):
                 prog.update(progcount, total)
 
                 while proc.returncode is None:
-                    time.sleep(timeout)
+                    # Wake up as soon as the process has
+                    # finished, rather than sleeping out
+                    # the full refresh interval. Popen.wait
+                    # does not accept a timeout in python 2.
+                    if PYVER[0] < 3:
+                        time.sleep(timeout)
+                    elif proc.popen.returncode is None:
+                        try:                      proc.popen.wait(timeout)
+                        except sp.TimeoutExpired: pass
+                    if proc.popen.returncode is not None:
+                        proc.stdout_thread.join(timeout)
+                        proc.stderr_thread.join(timeout)
                     progcount = progfunc(proc) if total else None
                     prog.update(progcount, total)
                     proc.popen.poll()
@@ -1405,7 +1940,7 @@ class Process(object):
                     prog.update(total, total)
                 else:
                     raise RuntimeError('This command returned '
-                                       'an error: ' + cmd)
+                                       'an error: {}'.format(cmd))
 
 
     @staticmethod
@@ -1419,18 +1954,24 @@ class Process(object):
         is finished. Logs every line.
 
         :arg stream:       stream to forward
-        :arg queue:        queue.Queue to push lines onto
+        :arg queue:        queue.Queue to push lines onto, or None to
+                           discard them
         :arg cmd:          string - the command that is running
         :arg streamname:   string - 'stdout' or 'stderr'
         :arg log_output:   If True, log all stdout/stderr.
         :arg print_output: If True, print all stdout/stderr.
         """
 
+        # Undecodable bytes are replaced rather than
+        # raising an error - if this thread died, the
+        # process would block once the pipe filled up
+        readline = stream.readline
         while True:
-            line = stream.readline().decode('utf-8')
+            line = readline().decode('utf-8', 'replace')
             if line == '':
                 break
-            queue.put(line)
+            if queue is not None:
+                queue.put(line)
             if log_output:
                 log.debug(' [%s]: %s', streamname, line.rstrip())
             if print_output:
@@ -1442,7 +1983,8 @@ class Process(object):
         """Runs the given command via subprocess.Popen, as administrator if
         requested.
 
-        :arg cmd:        The command to run, as a string
+        :arg cmd:        The command to run, as a string, or as a list of
+                         arguments
 
         :arg admin:      Whether to run with administrative privileges
 
@@ -1460,18 +2002,32 @@ class Process(object):
 
         admin = admin and os.getuid() != 0
 
-        cmd              = shlex.split(cmd)
+        # Commands may be passed pre-split, which
+        # avoids tokenising them, and any quoting
+        # problems with paths containing spaces
+        if isstr(cmd):
+            cmd = shlex.split(cmd)
+
         kwargs['stdin']  = sp.PIPE
         kwargs['stdout'] = sp.PIPE
         kwargs['stderr'] = sp.PIPE
 
+        # Popen pipes are unbuffered by default in
+        # python 2, where readline (see forward_stream)
+        # then reads one byte at a time. Use buffered
+        # pipes, the default in python 3, so that
+        # output is read in large chunks.
+        kwargs.setdefault('bufsize', -1)
+
         if admin:
             proc = Process.sudo_popen(cmd, password, append_env, **kwargs)
         else:
             # if append_env has been specified,
             # add it to the normal env option.
             if append_env is not None:
-                env = kwargs.get('env', os.environ.copy())
+                env = kwargs.get('env')
+                if env is None:
+                    env = os.environ.copy()
                 env.update(append_env)
                 kwargs['env'] = env
 
@@ -1505,8 +2061,10 @@ class Process(object):
                 f.write('thisdir=$(cd $(dirname $0) && pwd)\n')
                 for k, v in append_env.items():
                     f.write('export {}="{}"\n'.format(k, v))
-                # shlex.join not available in py27
-                f.write(' '.join(cmd) + '\n')
+                # Quote each argument so that any containing
+                # spaces or shell metacharacters are passed
+                # intact (shlex.join not available in py27)
+                f.write(' '.join(shquote(c) for c in cmd) + '\n')
                 f.write('cd ${thisdir} && rm ${thisfile}\n')
 
         cmd  = ['sudo', '-S', '-k', wrapper]
@@ -1516,45 +2074,52 @@ class Process(object):
         return proc
 
 
+def parse_version(verstr):
+    """Parses a version string of the form W.X.Y.Z, where W, X, Y, and Z are
+    all integers, and returns a tuple of integers which can be used to
+    compare versions. A leading "v" is ignored, and parsing stops at the
+    first non-integer component.
+    """
+    # Version identifiers for official FSL
+    # releases will have up to four
+    # components (X.Y.Z.W), but we accept
+    # any number of (integer) components,
+    # as internal releases may have more.
+    components = []
+
+    # ignore a leading "v", e.g. v1.2.3
+    verstr = verstr.lower()
+    if verstr.startswith('v'):
+        verstr = verstr[1:]
+
+    for comp in verstr.split('.'):
+        try:              components.append(int(comp))
+        except Exception: break
+
+    return tuple(components)
+
+
 @ft.total_ordering
 class Version(object):
     """Class to represent and compare version strings.  Accepted version
     strings are of the form W.X.Y.Z, where W, X, Y, and Z are all integers.
+    See parse_version.
     """
     def __init__(self, verstr):
-        # Version identifiers for official FSL
-        # releases will have up to four
-        # components (X.Y.Z.W), but we accept
-        # any number of (integer) components,
-        # as internal releases may have more.
-        components = []
-
-        # ignore a leading "v", e.g. v1.2.3
         verstr = verstr.lower()
         if verstr.startswith('v'):
             verstr = verstr[1:]
-
-        for comp in verstr.split('.'):
-            try:              components.append(int(comp))
-            except Exception: break
-
-        self.components = components
+        self.components = parse_version(verstr)
         self.verstr     = verstr
 
     def __str__(self):
         return self.verstr
 
     def __eq__(self, other):
-        for sn, on in zip(self.components, other.components):
-            if sn != on:
-                return False
-        return len(self.components) == len(other.components)
+        return self.components == other.components
 
     def __lt__(self, other):
-        for p1, p2 in zip(self.components, other.components):
-            if p1 < p2: return True
-            if p1 > p2: return False
-        return len(self.components) < len(other.components)
+        return self.components < other.components
 
 
 class Context(object):
@@ -1836,11 +2401,12 @@ class Context(object):
             response  = op.expanduser(op.expandvars(response))
             response  = op.abspath(response)
             parentdir = op.dirname(response)
-            if op.exists(parentdir):
+            if op.isdir(parentdir):
                 destdir = response
             else:
                 printmsg('Destination directory {} does not '
-                         'exist!'.format(parentdir), ERROR)
+                         'exist, or is not a directory!'.format(parentdir),
+                         ERROR)
                 response = None
 
         self.__destdir = destdir
@@ -1996,7 +2562,7 @@ class Context(object):
         Process.monitor_progress. For example:
 
             ctx = Context(...)
-            ctx.run(Process.check_call, 'my_command')
+            ctx.run(Process.check_call, ['my_command', 'arg'])
             ctx.run(Process.monitor_progress, 'my_command', total=100)
         """
 
@@ -2056,7 +2622,8 @@ def check_rosetta_status(ctx):
     # The pkgutil command should return 0 if
     # rosetta is installed, non-0 otherwise.
     try:
-        Process.check_output('pkgutil --files com.apple.pkg.RosettaUpdateAuto')
+        Process.check_output(
+            ['pkgutil', '--files', 'com.apple.pkg.RosettaUpdateAuto'])
     except RuntimeError:
         printmsg('Rosetta emulation does not appear to be enabled!\n', ERROR)
         printmsg('Enable rosetta emulation, and then run this installer '
@@ -2077,19 +2644,24 @@ def check_rosetta_status(ctx):
 
 def list_available_versions(manifest):
     """Lists available FSL versions. """
-    printmsg('Available FSL versions:', EMPHASIS)
-    versions = list(manifest['versions'].keys())
-    versions = reversed(sorted([Version(v) for v in versions]))
+
+    # The listing is accumulated and passed
+    # to printmsg in a single call, rather
+    # than printing one line at a time.
+    msg      = ['Available FSL versions:', EMPHASIS]
+    versions = [v for v in manifest['versions'].keys() if v != 'latest']
+    versions = sorted(versions, key=parse_version, reverse=True)
+
     for version in versions:
-        if str(version) == 'latest':
-            continue
-        printmsg(str(version), IMPORTANT, EMPHASIS)
-        for build in manifest['versions'][str(version)]:
-            printmsg('  {}'.format(build['platform']), EMPHASIS, end=' ')
-            printmsg(build['environment'], INFO)
+        msg.extend(['\n', version, IMPORTANT, EMPHASIS])
+        for build in manifest['versions'][version]:
+            msg.extend(['\n  {} '.format(build['platform']), EMPHASIS,
+                        build['environment'],                 INFO])
             if len(build.get('extras', [])) > 0:
                 extras = ', '.join(build['extras'])
-                printmsg('  Extras: {}'.format(extras), INFO)
+                msg.extend(['\n  Extras: {}'.format(extras), INFO])
+
+    printmsg(*msg, fill=False)
 
 
 def prompt_dev_release(devreleases, latest):
@@ -2341,20 +2913,28 @@ def download_fsl_environment_files(ctx):
 
     ctx.extra_environment_files = {}
 
+    # The environment files are small and do
+    # not depend on each other, so we download
+    # them all at once, rather than waiting for
+    # the connection latency of each in turn.
+    downloads = []
     for envname, build in allenvs:
-
-        url      = build['environment']
-        checksum = build.get('sha256', None)
-
+        url   = build['environment']
+        fname = url.split('/')[-1]
         printmsg('Downloading FSL environment specification '
                  'from {}...'.format(url))
+        downloads.append(background_download(
+            url, fname, ssl_verify=(not ctx.args.skip_ssl_verify)))
 
-        fname = url.split('/')[-1]
+    for (envname, build), download in zip(allenvs, downloads):
 
-        download_file(url, fname, ssl_verify=(not ctx.args.skip_ssl_verify))
+        url      = build['environment']
+        checksum = build.get('sha256', None)
+        fname    = url.split('/')[-1]
+        hashobj  = download()
 
         if (checksum is not None) and (not ctx.args.no_checksum):
-            sha256(fname, checksum)
+            sha256(fname, checksum, hashobj=hashobj)
 
         # Environment files for internal/dev FSL versions
         # will list the internal FSL conda channel with
@@ -2471,11 +3051,14 @@ def download_miniconda(ctx, **kwargs):
     with Progress('MB', transform=Progress.bytes_to_mb,
                   proglabel='download_miniconda',
                   progfile=ctx.args.progress_file,
+                  interval=0.1,
                   **kwargs) as prog:
+        hashobj = hashlib.sha256()
         download_file(url, 'miniconda.sh', prog.update,
-                      ssl_verify=(not ctx.args.skip_ssl_verify))
+                      ssl_verify=(not ctx.args.skip_ssl_verify),
+                      hashobj=hashobj)
     if (not ctx.args.no_checksum) and (checksum is not None):
-        sha256('miniconda.sh', checksum)
+        sha256('miniconda.sh', checksum, hashobj=hashobj)
 
 
 def install_miniconda(ctx, **kwargs):
@@ -2518,14 +3101,14 @@ def install_miniconda(ctx, **kwargs):
     # a tarball (micromamba).
     printmsg('Installing conda at {}...'.format(ctx.basedir))
     if is_shell_script('miniconda.sh'):
-        cmd = 'bash miniconda.sh -b -p {}'.format(ctx.basedir)
-        ctx.run(Process.monitor_progress, cmd, total=output,
+        cmd = ['bash', 'miniconda.sh', '-b', '-p', ctx.basedir]
+        ctx.run(Process.monitor_progress, [cmd], total=output,
                 proglabel='install_miniconda',
                 progfile=ctx.args.progress_file,
                 **kwargs)
     else:
-        cmds = ['mkdir {}'                    .format(ctx.basedir),
-                'tar -x -f miniconda.sh -C {}'.format(ctx.basedir)]
+        cmds = [['mkdir', ctx.basedir],
+                ['tar', '-x', '-f', 'miniconda.sh', '-C', ctx.basedir]]
         with Progress(label='%',
                       fmt='{:.0f}',
                       total=1,
@@ -2537,7 +3120,7 @@ def install_miniconda(ctx, **kwargs):
 
     # Avoid WSL filesystem issue
     # https://github.com/conda/conda/issues/9948#issuecomment-909989810
-    cmd = 'find {} -type f -exec touch {{}} +'.format(ctx.basedir)
+    cmd = ['find', ctx.basedir, '-type', 'f', '-exec', 'touch', '{}', '+']
     ctx.run(Process.check_call, cmd)
 
 
@@ -2585,11 +3168,11 @@ def install_wrapper_scripts(ctx, **kwargs):
         with open('removeFSLWrapper', 'wt') as f:
             f.write(removeFSLWrapperText)
 
-        cmds = ['mkdir -p {}'           .format(destdir),
-                'cp createFSLWrapper {}'.format(createFSLWrapperDest),
-                'cp removeFSLWrapper {}'.format(removeFSLWrapperDest),
-                'chmod 755 {}'          .format(createFSLWrapperDest),
-                'chmod 755 {}'          .format(removeFSLWrapperDest)]
+        cmds = [['mkdir', '-p',             destdir],
+                ['cp',    'createFSLWrapper', createFSLWrapperDest],
+                ['cp',    'removeFSLWrapper', removeFSLWrapperDest],
+                ['chmod', '755',              createFSLWrapperDest],
+                ['chmod', '755',              removeFSLWrapperDest]]
 
         for cmd in cmds:
             ctx.run(Process.check_call, cmd)
@@ -2890,8 +3473,8 @@ def install_fsl(ctx, **kwargs):
         f.write(condarc_contents)
 
     condarc = op.join(ctx.destdir, '.condarc')
-    cmds    = ['mkdir -p ' + ctx.destdir,
-               'cp -f .condarc ' + condarc]
+    cmds    = [['mkdir', '-p', ctx.destdir],
+               ['cp', '-f', '.condarc', condarc]]
 
     for cmd in cmds:
         ctx.run(Process.check_call, cmd)
@@ -2917,20 +3500,20 @@ def install_fsl(ctx, **kwargs):
     # We install FSL simply by running conda
     # env [update|create] -f env.yml.
     envfile = ctx.environment_file
-    cmd     = (ctx.conda + ' env ' + cmd +
-               ' -p ' + ctx.destdir      +
-               ' -f ' + envfile)
+    cmd     = [ctx.conda, 'env', cmd,
+               '-p', ctx.destdir,
+               '-f', envfile]
 
     # Another method employed to try and persuade
     # conda to ignore other .condarc files. The --rc-file
     # flag is only supported by mamba/micromamba
     if op.basename(ctx.conda) in ('mamba', 'micromamba'):
-        cmd += ' --rc-file ' + condarc
+        cmd += ['--rc-file', condarc]
 
     # Make conda/mamba super verbose if the
     # hidden --debug option was specified.
     if ctx.args.debug:
-        cmd += ' -v -v -v'
+        cmd += ['-v', '-v', '-v']
 
     printmsg('Installing FSL into {}...'.format(ctx.destdir))
 
@@ -2964,7 +3547,7 @@ def install_fsl(ctx, **kwargs):
             return len(logmsgs) > 0
 
         retry_on_error(ctx.run, ctx.args.num_retries, Process.monitor_progress,
-                       cmd, append_env=env, timeout=2, total=progval,
+                       [cmd], append_env=env, timeout=2, total=progval,
                        progfunc=progfunc, proglabel='install_fsl',
                        progfile=ctx.args.progress_file,
                        retry_error_message=err_message,
@@ -2987,9 +3570,9 @@ def install_extra(ctx, name, **kwargs):
     if not op.exists(destdir): action = 'create'
     else:                      action = 'update'
 
-    cmd = (ctx.conda + ' env ' + action +
-               ' -p ' + destdir +
-               ' -f ' + envfile)
+    cmd = [ctx.conda, 'env', action,
+           '-p', destdir,
+           '-f', envfile]
 
     env     = {}
     condarc = op.join(ctx.destdir, '.condarc')
@@ -2999,16 +3582,16 @@ def install_extra(ctx, name, **kwargs):
         env['CONDARC'] = condarc
 
         if op.basename(ctx.conda) in ('mamba', 'micromamba'):
-            cmd += ' --rc-file ' + condarc
+            cmd += ['--rc-file', condarc]
 
     if ctx.args.debug:
-        cmd += ' -v -v -v'
+        cmd += ['-v', '-v', '-v']
 
     progval, progfunc = get_install_fsl_progress_reporting_method(
         ctx, ctx.build['extras'][name], destdir)
 
     printmsg('Installing {} into {}...'.format(name, destdir))
-    ctx.run(Process.monitor_progress, cmd, append_env=env,
+    ctx.run(Process.monitor_progress, [cmd], append_env=env,
             timeout=2, total=progval, progfunc=progfunc,
             proglabel='install_{}'.format(name),
             progfile=ctx.args.progress_file,
@@ -3029,11 +3612,11 @@ def finalise_installation(ctx):
         f.write(ctx.build['version'])
 
     etcdir = op.join(ctx.destdir, 'etc')
-    cmds   = ['cp fslversion {}' .format(etcdir),
-              'cp {} {}'         .format(ctx.environment_file, etcdir)]
+    cmds   = [['cp', 'fslversion',           etcdir],
+              ['cp', ctx.environment_file, etcdir]]
 
     for envfile in ctx.extra_environment_files.values():
-        cmds.append('cp {} {}'.format(envfile, etcdir))
+        cmds.append(['cp', envfile, etcdir])
 
     for cmd in cmds:
         ctx.run(Process.check_call, cmd)
@@ -3045,10 +3628,10 @@ def finalise_installation(ctx):
 def post_install_cleanup(ctx, tmpdir):
     """Cleans up the FSL directory after installation. """
 
-    cmds = [ctx.conda + ' clean -y --all']
+    cmds = [[ctx.conda, 'clean', '-y', '--all']]
 
     if tmpdir is not None:
-        cmds.append('rm -rf ' + tmpdir)
+        cmds.append(['rm', '-rf', tmpdir])
 
     for cmd in cmds:
         ctx.run(Process.check_call, cmd)
@@ -3069,13 +3652,13 @@ def register_installation(ctx):
 
     # Exclude hostname from uname output, as
     # it may contain identifying information
-    uname  = Process.check_output('uname -msrv', check=False)
+    uname  = Process.check_output(['uname', '-msrv'], check=False)
     system = platform.system().lower()
     osinfo = ''
 
     # macOS
     if system == 'darwin':
-        osinfo = Process.check_output('sw_vers', check=False)
+        osinfo = Process.check_output(['sw_vers'], check=False)
 
     # Linux
     else:
@@ -3086,7 +3669,8 @@ def register_installation(ctx):
             osinfo = 'Unknown'
         # WSL
         if 'microsoft' in uname.lower():
-            osinfo += '\n\n' + Process.check_output('wsl.exe -v', check=False)
+            osinfo += '\n\n' + Process.check_output(['wsl.exe', '-v'],
+                                                 check=False)
     info = {
         'architecture'   : platform.machine(),
         'os'             : system,
@@ -3112,20 +3696,34 @@ def patch_file(filename, searchline, numlines, content):
     from searchline) are replaced with content.
 
     Otherwise, content is appended to the end of the file.
+
+    If the numlines lines starting from searchline are already identical
+    to content, the file is not modified.
     """
 
     content = content.split('\n')
 
-    if op.isfile(filename):
+    # Only a missing file is treated as empty -
+    # we don't want to clobber a file that we
+    # can't read for some other reason.
+    try:
         with open(filename) as f:
-            lines = [l.strip() for l in f.readlines()]
-    else:
+            lines = [l.strip() for l in f]
+    except (IOError, OSError) as e:
+        if e.errno != errno.ENOENT:
+            raise
         lines = []
 
     # replace block
     try:
         idx   = lines.index(searchline)
-        lines = lines[:idx] + content + lines[idx + numlines:]
+
+        # block is already up to date
+        if lines[idx:idx + numlines] == content:
+            log.debug('%s is already up to date', filename)
+            return
+
+        lines[idx:idx + numlines] = content
 
     # append to end
     except ValueError:
@@ -3240,12 +3838,16 @@ def self_update(manifest, workdir, checksum, **kwargs):
     """Checks to see if a newer version of the installer (this script) is
     available and if so, downloads it to a temporary file, and runs it in
     place of this script.
+
+    A copy of the new installer is saved to the cache directory (see
+    cache_dir), named according to its SHA256 checksum, so that it does
+    not need to be downloaded again if this script is re-run.
     """
 
-    thisver   = Version(__version__)
-    latestver = Version(manifest['installer']['version'])
+    thisver   = __version__
+    latestver = manifest['installer']['version']
 
-    if latestver <= thisver:
+    if parse_version(latestver) <= parse_version(thisver):
         log.debug('Installer is up to date (this version: %s, '
                   'latest version: %s)', thisver, latestver)
         return
@@ -3253,20 +3855,59 @@ def self_update(manifest, workdir, checksum, **kwargs):
     log.debug('New version of installer is available '
               '(%s) - self-updating', latestver)
 
-    tmpf = tempfile.NamedTemporaryFile(
-        prefix='new_fslinstaller', delete=False, dir=workdir)
-    tmpf.close()
-    tmpf = tmpf.name
+    expected = manifest['installer'].get('sha256')
+    cachedir = cache_dir()
+    cached   = None
+    tmpf     = None
 
-    download_file(manifest['installer']['url'], tmpf, **kwargs)
+    # Use a previously downloaded copy
+    # if it matches the expected checksum
+    if expected and (cachedir is not None):
+        cached = op.join(cachedir, 'installer-{}.py'.format(expected))
+        if op.exists(cached):
+            try:
+                sha256(cached, expected)
+                log.debug('Using cached installer %s', cached)
+                tmpf = cached
+            except Exception:
+                pass
 
-    if checksum:
-        try:
-            sha256(tmpf, manifest['installer']['sha256'])
-        except Exception as e:
-            printmsg('New installer file does not match expected '
-                     'checksum! Skipping update.', WARNING)
-            return
+    if tmpf is None:
+        tmpf = tempfile.NamedTemporaryFile(
+            prefix='new_fslinstaller', delete=False, dir=workdir)
+        tmpf.close()
+        tmpf = tmpf.name
+
+        hashobj = hashlib.sha256()
+        download_file(manifest['installer']['url'], tmpf, hashobj=hashobj,
+                      **kwargs)
+
+        if checksum:
+            try:
+                sha256(tmpf, expected, hashobj=hashobj)
+            except Exception as e:
+                printmsg('New installer file does not match expected '
+                         'checksum! Skipping update.', WARNING)
+                return
+
+        # Only cache files that we know are intact
+        if (cached is not None) and (hashobj.hexdigest() == expected):
+            try:
+                if not op.exists(cachedir):
+                    os.makedirs(cachedir)
+                fd, cachetmp = tempfile.mkstemp(dir=cachedir)
+                os.close(fd)
+                shutil.copyfile(tmpf, cachetmp)
+                os.rename(cachetmp, cached)
+
+                # Run the cached copy, so the
+                # download is not left behind
+                # in the work directory
+                os.remove(tmpf)
+                tmpf = cached
+            except Exception as e:
+                log.debug('Could not cache installer %s: %s', tmpf, e,
+                          exc_info=True)
 
     # Don't try and update again - if for some
     # reason the online manifest reports a newer
@@ -3317,8 +3958,7 @@ def overwrite_destdir(ctx):
             break
 
     printmsg('Deleting directory {}'.format(ctx.destdir), IMPORTANT)
-    ctx.run(Process.check_call,
-            'mv {} {}'.format(ctx.destdir, ctx.old_destdir))
+    ctx.run(Process.check_call, ['mv', ctx.destdir, ctx.old_destdir])
 
 
 def parse_args(argv=None, include=None, parser=None):
@@ -3589,7 +4229,7 @@ def parse_args(argv=None, include=None, parser=None):
     args = parser.parse_known_args(argv)[0]
 
     if getattr(args, 'fslversion', 'latest') != 'latest':
-        if Version(args.fslversion) < Version('6.0.6'):
+        if parse_version(args.fslversion) < (6, 0, 6):
             printmsg(
                 'This script can only be used to install FSL 6.0.6 or newer. '
                 'Visit https://fsl.fmrib.ox.ac.uk/fsl/fslwiki/FslInstallation '
@@ -3745,7 +4385,7 @@ def handle_error(ctx):
         if op.exists(ctx.destdir):
             printmsg('Removing failed installation directory '
                      '{}'.format(ctx.destdir), WARNING)
-            ctx.run(Process.check_call, 'rm -r ' + ctx.destdir)
+            ctx.run(Process.check_call, ['rm', '-r', ctx.destdir])
 
         # overwrite_destdir moves the existing
         # destdir to a temp location, so we can
@@ -3754,7 +4394,7 @@ def handle_error(ctx):
             printmsg('Restoring contents of {}'.format(ctx.destdir),
                      WARNING)
             ctx.run(Process.check_call,
-                    'mv {} {}'.format(ctx.old_destdir, ctx.destdir))
+                    ['mv', ctx.old_destdir, ctx.destdir])
 
         # copy log file to ~/ so it is
         # easier for the user to access
@@ -3803,6 +4443,18 @@ def main(argv=None):
         list_available_versions(ctx.manifest)
         sys.exit(0)
 
+    # nvidia-smi can be slow to start, so query
+    # the GPU in the background while the user
+    # responds to the installation prompts. The
+    # result is cached by identify_cuda, and is
+    # used by add_cuda_packages. We start this
+    # after self_update, as it may replace this
+    # process with a new installer.
+    cudaprobe = None
+    if args.cuda is None:
+        cudaprobe = threading.Thread(target=identify_cuda)
+        cudaprobe.start()
+
     agree_to_license(ctx)
 
     if (not args.skip_registration) and (ctx.registration_url is not None):
@@ -3838,6 +4490,13 @@ def main(argv=None):
         # an existing installation
         overwrite_destdir(ctx)
 
+        # funccache does not de-duplicate concurrent
+        # calls, so make sure the GPU query has
+        # finished before add_cuda_packages is
+        # called, to avoid running nvidia-smi twice
+        if cudaprobe is not None:
+            cudaprobe.join()
+
         download_fsl_environment_files(ctx)
         printmsg('\nInstalling FSL in {}\n'.format(ctx.destdir), EMPHASIS)
 
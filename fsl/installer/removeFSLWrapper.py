@@ -21,6 +21,12 @@ import os.path as op
 import sys
 
 
+# Suffix used for FSL GUI commands
+# (see createFSLWrapper)
+GUI_SUFFIX     = '_gui'
+GUI_SUFFIX_LEN = len(GUI_SUFFIX)
+
+
 def main(argv=None):
     if argv is None:
         argv = sys.argv[1:]
@@ -32,8 +38,8 @@ def main(argv=None):
     fsldir  = os.environ.get('FSLDIR', None)
     prefix  = os.environ.get('PREFIX', None)
 
-    if fsldir is not None: fsldir = op.realpath(op.abspath(fsldir))
-    if prefix is not None: prefix = op.realpath(op.abspath(prefix))
+    if fsldir is not None: fsldir = op.realpath(fsldir)
+    if prefix is not None: prefix = op.realpath(prefix)
 
     # Only remove wrappers if FSLDIR
     # exists and if PREFIX is equal to
@@ -43,6 +49,16 @@ def main(argv=None):
        not prefix.startswith(fsldir):
         return 0
 
+    # The contents of the wrapper directory are
+    # listed once, rather than checking for the
+    # existence of each wrapper individually.
+    wrapperdir  = op.join(fsldir, 'share', 'fsl', 'bin')
+    wrapperpref = op.join(wrapperdir, '')
+    linux       = sys.platform.lower().startswith('linux')
+
+    if op.isdir(wrapperdir): existing = set(os.listdir(wrapperdir))
+    else:                    existing = set()
+
     for target in targets:
 
         # A wrapper script with a different
@@ -53,23 +69,21 @@ def main(argv=None):
         if len(target) == 2: target, wrapper = target
         else:                target, wrapper = target[0], target[0]
 
-        wrapper = op.join(fsldir, 'share', 'fsl', 'bin', wrapper)
-
         # On Linux there may be two wrapper scripts
         # for GUI tools - "<Tool>" and "<Tool>_gui".
         # We delete them both.
-        linux = sys.platform.lower().startswith('linux')
-        gui   = linux and wrapper.endswith('_gui')
+        gui = linux and (wrapper[-GUI_SUFFIX_LEN:] == GUI_SUFFIX)
 
         if gui:
-            wrapper  = wrapper.removesuffix('_gui')
-            wrappers = [wrapper, wrapper + '_gui']
+            base     = wrapper[:-GUI_SUFFIX_LEN]
+            wrappers = [base, wrapper]
         else:
             wrappers = [wrapper]
 
         for wrapper in wrappers:
-            if op.exists(wrapper):
-                os.remove(wrapper)
+            if wrapper in existing:
+                os.remove(wrapperpref + wrapper)
+                existing.discard(wrapper)
 
     return 0
 
@@ -20,6 +20,14 @@ import sys
 import fsl.installer.fslinstaller as inst
 
 
+# Make sure that tests never read from or
+# write to the download cache in the real
+# home directory (see inst.cache_dir). Tests
+# which use the cache must re-enable it, and
+# point $XDG_CACHE_HOME at a temp directory.
+os.environ['FSLINSTALLER_NO_CACHE'] = '1'
+
+
 # py3
 try:
     import queue
@@ -78,6 +86,45 @@ class HTTPServer(mp.Process):
         def ctr(cls, posts):
             return ft.partial(cls, posts=posts)
 
+        def end_headers(self):
+            self.send_header('Accept-Ranges', 'bytes')
+            http.SimpleHTTPRequestHandler.end_headers(self)
+
+        def do_GET(self):
+
+            # Serve <file>.gz, if it exists, for
+            # clients accepting gzip encoding
+            # (like nginx gzip_static)
+            path = self.translate_path(self.path)
+            gzip = 'gzip' in self.headers.get('Accept-Encoding', '')
+            if gzip and op.exists(path + '.gz'):
+                with open(path + '.gz', 'rb') as f:
+                    data = f.read()
+                self.send_response(200)
+                self.send_header('Content-Length',   str(len(data)))
+                self.send_header('Content-Encoding', 'gzip')
+                self.end_headers()
+                self.wfile.write(data)
+                return
+
+            rng = self.headers.get('Range')
+            if rng is None:
+                return http.SimpleHTTPRequestHandler.do_GET(self)
+
+            path       = self.translate_path(self.path)
+            size       = op.getsize(path)
+            start, end = [int(v) for v in rng.split('=')[1].split('-')]
+            with open(path, 'rb') as f:
+                f.seek(start)
+                data = f.read(end - start + 1)
+
+            self.send_response(206)
+            self.send_header('Content-Length', str(len(data)))
+            self.send_header('Content-Range',
+                             'bytes {}-{}/{}'.format(start, end, size))
+            self.end_headers()
+            self.wfile.write(data)
+
         def do_POST(self):
 
             nbytes = int(self.headers['Content-Length'])
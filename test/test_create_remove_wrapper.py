@@ -549,3 +549,69 @@ def test_create_wrappers_symlink():
 
         assert not op.exists(op.join(wrapperdir, 'test_script1'))
         assert not op.exists(op.join(wrapperdir, 'test_script2'))
+
+
+def test_create_wrappers_dangling_symlink():
+    """Wrappers should not be created for dangling symlinks in $FSLDIR/bin/,
+    as the target executable does not exist.
+    """
+    with temp_fsldir() as (fsldir, wrapperdir):
+        bindir = op.join(fsldir, 'bin')
+        touch(op.join(bindir, 'test_script1'))
+        os.symlink('test_script1',   op.join(bindir, 'test_script2'))
+        os.symlink('does_not_exist', op.join(bindir, 'test_script3'))
+
+        assert createWrapper('test_script1', 'test_script2', 'test_script3')
+
+        assert     op.exists(op.join(wrapperdir, 'test_script1'))
+        assert     op.exists(op.join(wrapperdir, 'test_script2'))
+        assert not op.lexists(op.join(wrapperdir, 'test_script3'))
+
+    # A dangling Tool_gui should fall back to Tool on linux
+    with temp_fsldir() as (fsldir, wrapperdir):
+        bindir = op.join(fsldir, 'bin')
+        touch(op.join(bindir, 'Tool'))
+        os.symlink('does_not_exist', op.join(bindir, 'Tool_gui'))
+
+        assert createWrapper('Tool_gui', '-p', 'linux')
+
+        tool_gui = op.join(wrapperdir, 'Tool_gui')
+        assert op.exists(tool_gui)
+        assert get_called_command(tool_gui) == 'Tool'
+
+
+def test_parse_args_fast():
+    """Test that the hand-written argument parser gives the same results as
+    argparse, and defers to argparse for anything it does not understand.
+    """
+
+    # arguments which should be handled by the fast parser
+    handled = [
+        [],
+        ['script1', 'script2'],
+        ['script1', '-f'],
+        ['-f', 'script1', 'script2'],
+        ['-a', ' --extra --thing', 'script1'],
+        ['-s', '/src', '-d', '/dest', '-r', 'script1', 'script2'],
+        ['--srcdir', '/src', '--destdir', '/dest', '--no-resolve', 'script1'],
+        ['script1=renamed', 'Script_gui', '-p', 'darwin'],
+    ]
+
+    # arguments which should be deferred to argparse
+    deferred = [
+        ['script1', '-f', 'script2'],
+        ['-a', '-v', 'script1'],
+        ['--args=-v', 'script1'],
+        ['-fr', 'script1'],
+        ['--', 'script1'],
+        ['-h'],
+    ]
+
+    for argv in handled:
+        fast = createFSLWrapper.parse_args_fast(argv)
+        slow = createFSLWrapper.parse_args_argparse(argv)
+        assert fast is not None
+        assert vars(fast) == vars(slow)
+
+    for argv in deferred:
+        assert createFSLWrapper.parse_args_fast(argv) is None
@@ -153,12 +153,19 @@ def test_installer_cuda_local_gpu():
 
         destdir = 'fsl'
 
-        fi.main(('--root_env',
-                 '--homedir', cwd,
-                 '--dest',    destdir))
+        with mock.patch.object(fi.Process, 'check_output',
+                               wraps=fi.Process.check_output) as co:
+            fi.main(('--root_env',
+                     '--homedir', cwd,
+                     '--dest',    destdir))
 
         check_install(destdir, '11.2')
 
+        # GPU should only be queried once
+        nvsmi = [c for c in co.call_args_list
+                 if c[0][0][0] == 'nvidia-smi']
+        assert len(nvsmi) == 1
+
 
 @reset_caches
 def test_installer_cuda_local_gpu_different_cuda_requested():
@@ -5,6 +5,7 @@ import               os
 import os.path    as op
 import textwrap   as tw
 import subprocess as sp
+import time
 
 try:
     from unittest import mock
@@ -90,6 +91,44 @@ def test_Process_check_output():
                 assert got.strip() == expect
 
 
+def test_Process_queue_output():
+    with inst.tempdir() as cwd:
+        cmd  = 'echo hello'
+        proc = inst.Process(cmd, queue_output=False)
+        proc.wait()
+        assert proc.returncode == 0
+        assert proc.stdoutq.empty()
+
+        proc = inst.Process(cmd)
+        proc.wait()
+        assert proc.stdoutq.get_nowait().strip() == 'hello'
+
+
+def test_Process_check_output_list():
+    with inst.tempdir() as cwd:
+        script = tw.dedent("""
+        #!/usr/bin/env sh
+        echo "$1"
+        """).strip()
+
+        with open('script', 'wt') as f:
+            f.write(script)
+        os.chmod('script', 0o755)
+
+        # pre-split arguments are not re-tokenised
+        cmd = [op.join(cwd, 'script'), 'one two']
+        assert inst.Process.check_output(cmd).strip() == 'one two'
+
+
+def test_Process_check_output_invalid_utf8():
+    with inst.tempdir() as cwd:
+        with open('script', 'wt') as f:
+            f.write('#!/usr/bin/env bash\nprintf "a\\377b\\n"\n')
+        os.chmod('script', 0o755)
+        got = inst.Process.check_output(op.join(cwd, 'script'))
+        assert got == u'a\ufffdb\n'
+
+
 def test_Process_monitor_progress():
     with inst.tempdir() as cwd:
         script = tw.dedent("""
@@ -117,11 +156,26 @@ def test_Process_monitor_progress():
             inst.Process.monitor_progress( script + ' e',                 10)
             inst.Process.monitor_progress([script + ' f'],                10)
             inst.Process.monitor_progress([script + ' g', script + ' h'], 10)
+            inst.Process.monitor_progress([[script, 'i'], script + ' j'], 10)
 
-            for touched in 'abcdefgh':
+            for touched in 'abcdefghij':
                 assert op.exists(touched)
                 os.remove(touched)
 
+def test_Process_monitor_progress_returns_promptly():
+    with inst.tempdir() as cwd:
+        with open('script', 'wt') as f:
+            f.write('#!/usr/bin/env bash\nfor i in 1 2 3; do echo $i; done\n')
+        os.chmod('script', 0o755)
+
+        # should not wait for the full
+        # refresh interval once the
+        # process has finished
+        start = time.time()
+        inst.Process.monitor_progress(op.join(cwd, 'script'), 3, timeout=20)
+        assert time.time() - start < 10
+
+
 def test_Process_sudo_popen():
     with inst.tempdir() as cwd:
         cmd = tw.dedent("""
@@ -147,6 +201,32 @@ def test_Process_sudo_popen():
             assert f.read().strip() == 'Running cmd'
 
 
+def test_Process_sudo_popen_spaces():
+    with inst.tempdir() as cwd:
+        cmd = tw.dedent("""
+        #!/usr/bin/env bash
+
+        echo "$#"  >  command_output
+        echo "$1"  >> command_output
+        echo "$2"  >> command_output
+        """).strip()
+
+        with open('sudo', 'wt') as f: f.write(SUDO)
+        with open('cmd', 'wt')  as f: f.write(cmd)
+        os.chmod('sudo', 0o755)
+        os.chmod('cmd',  0o755)
+
+        path = op.pathsep.join((cwd, os.environ['PATH']))
+
+        with mock.patch.dict(os.environ, PATH=path):
+            p = inst.Process.sudo_popen(['cmd', 'a b  c', "it's; $HOME"],
+                                        'password', stdin=sp.PIPE)
+            p.communicate()
+
+        with open('command_output', 'rt') as f:
+            assert f.read() == "2\na b  c\nit's; $HOME\n"
+
+
 def test_Process_popen_append_env():
 
     script = tw.dedent("""
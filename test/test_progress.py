@@ -8,6 +8,11 @@
 
 import time
 
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
 import fsl.installer.fslinstaller as fi
 
 
@@ -20,3 +25,29 @@ def test_progfile():
 
         exp = '\n'.join(['prog1 {} 5'.format(i + 1) for i in range(5)])
         assert open('prog1.txt', 'rt').read().strip() == exp
+
+
+def test_progress_interval():
+
+    with fi.tempdir():
+        with fi.Progress(proglabel='prog', progfile='prog.txt',
+                         interval=60) as prog:
+            for i in range(5):
+                prog.update(i + 1, 5)
+
+        # first and final updates only
+        exp = 'prog 1 5\nprog 5 5'
+        assert open('prog.txt', 'rt').read().strip() == exp
+
+
+def test_progress_terminal_width():
+
+    with mock.patch.object(fi, 'get_terminal_width',
+                           return_value=80) as gtw:
+        with fi.Progress() as prog:
+            for i in range(5):
+                prog.update(i + 1, 5)
+
+    # width should only be queried once
+    assert gtw.call_count == 1
+    assert prog.width     == 80
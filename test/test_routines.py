@@ -1,6 +1,10 @@
 #!/usr/bin/env python
 
 import datetime
+import gzip
+import hashlib
+import io
+import json
 import logging
 import os
 import os.path as op
@@ -57,6 +61,34 @@ def test_Version():
     assert inst.Version('1.2.3.0') >  inst.Version('1.2.3')
 
 
+def test_parse_version():
+    assert inst.parse_version('1.2.3')    == (1, 2, 3)
+    assert inst.parse_version('v1.2.3.4') == (1, 2, 3, 4)
+    assert inst.parse_version('3.17.0-1') == (3, 17)
+    assert inst.parse_version('latest')   == ()
+    assert inst.parse_version('6.0.5')    <  (6, 0, 6)
+    assert inst.parse_version('6.0.7.1')  >  (6, 0, 7)
+
+
+@pytest.mark.noroottest
+def test_check_need_admin():
+    with inst.tempdir():
+        os.mkdir('needs_admin')
+        os.mkdir('does_not_need_admin')
+        os.chmod('needs_admin',         0o555)
+        os.chmod('does_not_need_admin', 0o777)
+
+        assert     inst.check_need_admin('needs_admin')
+        assert not inst.check_need_admin('does_not_need_admin')
+
+        # non-existent directories are checked
+        # against their nearest existing parent
+        assert     inst.check_need_admin(op.join('needs_admin', 'a', 'b'))
+        assert not inst.check_need_admin(
+            op.join('does_not_need_admin', 'a', 'b'))
+        os.chmod('needs_admin', 0o755)
+
+
 def test_get_admin_password():
     sudo = tw.dedent("""
     #!/usr/bin/env bash
@@ -120,6 +152,212 @@ def test_download_file():
         with open('copy', 'rt') as f:
             assert f.read() == 'hello\n'
 
+        # or a file-like destination
+        buf = io.BytesIO()
+        inst.download_file('file', buf)
+        assert buf.getvalue() == b'hello\n'
+
+        # checksum calculated during download
+        hashobj = hashlib.sha256()
+        inst.download_file('file', buf, hashobj=hashobj)
+        assert hashobj.hexdigest() == inst.sha256('file')
+
+
+def test_background_download():
+    with inst.tempdir() as cwd:
+        with open('file', 'wb') as f:
+            f.write(b'hello\n')
+        with server(cwd) as srv:
+            wait1 = inst.background_download(
+                '{}/file'.format(srv.url), 'copy')
+            wait2 = inst.background_download(
+                '{}/missing'.format(srv.url), 'missing')
+
+            assert wait1().hexdigest() == inst.sha256('file')
+            with open('copy', 'rb') as f:
+                assert f.read() == b'hello\n'
+            with pytest.raises(Exception):
+                wait2()
+
+
+def test_background_writer():
+    got = []
+    with inst.background_writer(got.append, maxsize=2) as write:
+        for i in range(10):
+            write(i)
+    assert got == list(range(10))
+
+    def fail(block):
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        with inst.background_writer(fail) as write:
+            write(1)
+
+
+def test_download_file_ranges():
+
+    with inst.tempdir() as cwd:
+        data = os.urandom(1048576 + 13)
+        with open('file', 'wb') as f:
+            f.write(data)
+
+        progs = []
+        def progress(downloaded, total):
+            progs.append((downloaded, total))
+
+        with server(cwd) as srv, \
+             mock.patch.object(inst, 'PARALLEL_DOWNLOAD_THRESHOLD', 1024):
+
+            url = '{}/file'.format(srv.url)
+
+            hashobj = hashlib.sha256()
+            inst.download_file(url, 'copy', progress, nranges=4,
+                               hashobj=hashobj)
+            with open('copy', 'rb') as f:
+                assert f.read() == data
+            assert progs[-1] == (len(data), len(data))
+            assert hashobj.hexdigest() == hashlib.sha256(data).hexdigest()
+
+            # Fall back to serial download
+            # if a range request fails
+            with mock.patch.object(inst, 'download_file_ranges',
+                                   return_value=False):
+                os.remove('copy')
+                inst.download_file(url, 'copy', nranges=4)
+                with open('copy', 'rb') as f:
+                    assert f.read() == data
+
+            # Fall back to serial download if the server
+            # sends a different range to the one requested
+            urlopen = inst.urlrequest.urlopen
+            def badrange(req, *args, **kwargs):
+                resp = urlopen(req, *args, **kwargs)
+                if req.get_header('Range') is not None:
+                    resp.headers.replace_header('Content-Range',
+                                                'bytes 0-0/1')
+                return resp
+
+            with mock.patch.object(inst.urlrequest, 'urlopen', badrange):
+                assert not inst.download_file_ranges(
+                    url, 'copy', len(data), progress, nranges=4)
+                os.remove('copy')
+                hashobj = hashlib.sha256()
+                inst.download_file(url, 'copy', nranges=4, hashobj=hashobj)
+                with open('copy', 'rb') as f:
+                    assert f.read() == data
+                assert hashobj.hexdigest() == \
+                    hashlib.sha256(data).hexdigest()
+
+
+def test_download_manifest_comments():
+    manifest = tw.dedent("""
+    // comment
+    {
+      // comment
+      "installer" : {"version" : "1.0.0",
+                     "url"     : "http://localhost//fslinstaller.py"},
+        // comment
+      "versions"  : {"latest" : "6.0.7", "6.0.7" : [{}]}
+    }
+    """)
+    with inst.tempdir():
+        with open('manifest.json', 'wt') as f:
+            f.write(manifest)
+        got = inst.download_manifest('manifest.json')
+        assert got['installer']['url'] == 'http://localhost//fslinstaller.py'
+        assert got['versions']['6.0.7'] == [{'version' : '6.0.7'}]
+
+
+def test_download_manifest_gzip():
+
+    manifest = {'installer' : {'version' : '1.0.0'},
+                'versions'  : {'latest' : '6.0.7', '6.0.7' : []}}
+
+    with inst.tempdir() as cwd:
+        with open('manifest.json', 'wt') as f:
+            f.write('{}')
+        with gzip.open('manifest.json.gz', 'wb') as f:
+            f.write(json.dumps(manifest).encode())
+
+        with server(cwd) as srv, \
+             mock.patch.dict(os.environ, XDG_CACHE_HOME=cwd,
+                             FSLINSTALLER_NO_CACHE='0'):
+            url = '{}/manifest.json'.format(srv.url)
+            got = inst.download_manifest(url)
+            assert got['installer']['version'] == '1.0.0'
+
+
+def test_cache_dir():
+    env = dict(os.environ)
+    env.pop('XDG_CACHE_HOME', None)
+    env['FSLINSTALLER_NO_CACHE'] = '0'
+    env['HOME']                  = '/does/not/exist'
+    home = inst.pwd.getpwuid(os.getuid()).pw_dir
+
+    # home directory taken from the password
+    # database, not from $HOME (see parse_args)
+    with mock.patch.dict(os.environ, env, clear=True):
+        assert inst.cache_dir() == op.join(home, '.cache', 'fslinstaller')
+        os.environ['XDG_CACHE_HOME'] = '/cache'
+        assert inst.cache_dir() == op.join('/cache', 'fslinstaller')
+        os.environ['FSLINSTALLER_NO_CACHE'] = '1'
+        assert inst.cache_dir() is None
+
+
+def test_download_manifest_cache():
+
+    manifest = {'installer' : {'version' : '1.0.0'},
+                'versions'  : {'latest' : '6.0.7', '6.0.7' : []}}
+    cached   = {'installer' : {'version' : '2.0.0'},
+                'versions'  : {'latest' : '6.0.7', '6.0.7' : []}}
+
+    with inst.tempdir() as cwd:
+        os.mkdir('cache')
+        os.mkdir('srv')
+        with open(op.join('srv', 'manifest.json'), 'wt') as f:
+            f.write(json.dumps(manifest))
+
+        with server(op.join(cwd, 'srv')) as srv, \
+             mock.patch.dict(os.environ, XDG_CACHE_HOME=op.join(cwd, 'cache'),
+                             FSLINSTALLER_NO_CACHE='0'):
+
+            url    = '{}/manifest.json'.format(srv.url)
+            prefix = inst.manifest_cache_prefix(url)
+
+            got = inst.download_manifest(url)
+            assert got['installer']['version'] == '1.0.0'
+            assert op.exists(prefix + '.json')
+            assert op.exists(prefix + '.etag')
+
+            # Server should respond with 304 not
+            # modified, so the cached copy is used
+            with open(prefix + '.json', 'wt') as f:
+                f.write(json.dumps(cached))
+            got = inst.download_manifest(url)
+            assert got['installer']['version'] == '2.0.0'
+
+        # caching can be disabled
+        with mock.patch.dict(os.environ, FSLINSTALLER_NO_CACHE='1'):
+            assert inst.manifest_cache_prefix(url) is None
+
+        # local files are not cached
+        assert inst.manifest_cache_prefix(op.join('srv', 'manifest.json')) \
+            is None
+
+
+def test_urlopen_kwargs():
+    inst.urlopen_kwargs.reset()
+    try:
+        assert inst.urlopen_kwargs(True) == {}
+        with mock.patch.object(inst, 'printmsg') as pm:
+            kw1 = inst.urlopen_kwargs(False)
+            kw2 = inst.urlopen_kwargs(False)
+        assert kw1 is kw2
+        assert pm.call_count == 1
+    finally:
+        inst.urlopen_kwargs.reset()
+
 
 def test_download_file_skip_ssl_verify():
 
@@ -130,6 +368,24 @@ def test_download_file_skip_ssl_verify():
                            ssl_verify=False)
 
 
+def test_sha256():
+    with inst.tempdir():
+        with open('file', 'wb') as f:
+            f.write(b'hello\n')
+        exp = '5891b5b522d5df086d0ff0b110fbd9d21bb4fc7163af34d08286a2e846f6be03'
+        assert inst.sha256('file') == exp
+        assert inst.sha256('file', exp) == exp
+        with pytest.raises(Exception):
+            inst.sha256('file', 'abc')
+
+        # file is not read when a hash object is given
+        hashobj = hashlib.sha256(b'hello\n')
+        os.remove('file')
+        assert inst.sha256('file', exp, hashobj=hashobj) == exp
+        with pytest.raises(Exception):
+            inst.sha256('file', 'abc', hashobj=hashobj)
+
+
 def test_patch_file():
 
     content = tw.dedent("""
@@ -162,6 +418,23 @@ def test_patch_file():
         with open('file', 'rt') as f:
             assert f.read().strip() == expect
 
+        # file not rewritten if block is already present
+        original = '  indented\nline2\nline3\n'
+        with open('file', 'wt') as f:
+            f.write(original)
+        inst.patch_file('file', 'line2', 2, 'line2\nline3')
+        with open('file', 'rt') as f:
+            assert f.read() == original
+
+        # but it is if the content is elsewhere
+        # in the file, and not at searchline
+        original = 'line2\nother\nline3\nline2\n'
+        with open('file', 'wt') as f:
+            f.write(original)
+        inst.patch_file('file', 'line2', 2, 'line2\nline3')
+        with open('file', 'rt') as f:
+            assert f.read() == 'line2\nline3\nline3\nline2'
+
 
 def test_configure_shell():
 
@@ -433,7 +706,9 @@ def test_self_update():
     """).strip()
 
     with inst.tempdir() as cwd:
-        with server() as srv:
+        with server() as srv, \
+             mock.patch.dict(os.environ, XDG_CACHE_HOME=cwd,
+                             FSLINSTALLER_NO_CACHE='0'):
 
             shutil.copyfile(inst.__absfile__, 'fslinstaller.py')
             with open('new_installer.py', 'wt') as f:
@@ -449,6 +724,18 @@ def test_self_update():
             got = sp.check_output([sys.executable, 'script.py'])
             assert got.decode('utf-8').strip() == 'new version'
 
+            # new version should have been cached,
+            # and the temporary download removed
+            cached = op.join(cwd, 'fslinstaller',
+                             'installer-{}.py'.format(checksum))
+            assert inst.sha256(cached) == checksum
+            assert not any(f.startswith('new_fslinstaller')
+                           for f in os.listdir(cwd))
+            os.rename('new_installer.py', 'new_installer.py.bak')
+            got = sp.check_output([sys.executable, 'script.py'])
+            assert got.decode('utf-8').strip() == 'new version'
+            os.rename('new_installer.py.bak', 'new_installer.py')
+
             # new version available, bad checksum
             with open('script.py', 'wt') as f:
                 f.write(script_template.format(ver=newver,
@@ -648,6 +935,22 @@ def test_funccache():
     assert func(2)    == 4
     assert ncalled[0] == 4
 
+    # None results are cached, and
+    # kwargs are keyed by name
+    ncalled = [0]
+
+    @inst.funccache
+    def func(a=None, b=None):
+        ncalled[0] += 1
+        return a
+
+    assert func()       is None
+    assert func()       is None
+    assert ncalled[0]   == 1
+    assert func(a=1)    == 1
+    assert func(b=1)    is None
+    assert ncalled[0]   == 3
+
 
 def test_getlocale():
     with mock.patch('fsl.installer.fslinstaller.locale.getlocale') as mock_gl:
@@ -690,6 +993,14 @@ def test_identify_cuda():
             finally:
                 inst.identify_cuda.reset()
 
+        # nvidia-smi is not called on macOS
+        nvsmi('11.4', 0)
+        try:
+            with mock.patch('platform.system', return_value='Darwin'):
+                assert inst.identify_cuda() is None
+        finally:
+            inst.identify_cuda.reset()
+
 
 def test_add_cuda_packages():
     class Mock(object):